@@ -11,13 +11,34 @@ import cv2
 import numpy as np
 import os
 import warnings
-from skimage.filters.rank import entropy
-from skimage.morphology import square
-import copy
 import time
 
 warnings.filterwarnings("ignore")
 
+class BlurWorkspace(object):
+    # Named work buffers reused across frames. A buffer is only (re)allocated when a stage asks
+    # for a different shape or dtype than last time, so a stream of same-sized frames stops
+    # allocating after the first one. Not thread-safe - use one workspace (detector) per thread.
+    def __init__(self):
+        self.buffers = {}
+        self.layouts = {}
+        self.allocations = 0
+
+    def get(self, name, shape, dtype=np.float64):
+        buffer = self.buffers.get(name)
+        if(buffer is None or buffer.shape != tuple(shape) or buffer.dtype != dtype):
+            buffer = np.zeros(shape, dtype)
+            self.buffers[name] = buffer
+            self.allocations += 1
+        return(buffer)
+
+    def nbytes(self):
+        return(sum(buffer.nbytes for buffer in self.buffers.values()))
+
+    def clear(self):
+        self.buffers = {}
+        self.layouts = {}
+
 class BlurDetector(object):
     def __init__(self, downsampling_factor=4, num_scales=4, scale_start=3, entropy_filt_kernel_sze=7, sigma_s_RF_filter=15, sigma_r_RF_filter=0.25, num_iterations_RF_filter=3, show_progress = True):
         self.downsampling_factor = downsampling_factor
@@ -31,7 +52,11 @@ class BlurDetector(object):
         self.__freqBands = []
         self.__dct_matrices = []
         self.freq_index = []
+        self.__flat_freq_index = []
+        self.__footprint = None
+        self.__entropy = None
         self.show_progress = show_progress
+        self.workspace = BlurWorkspace()
 
     def disp_progress(self, i, rows, old_progress):
         progress_dict = {10:'[|                  ] 10%',
@@ -59,13 +84,17 @@ class BlurDetector(object):
             scales.append((2**(self.scale_start + i)) - 1)          # Scales would be 7, 15, 31, 63 ...
         return(scales)
 
-    def computeImageGradientMagnitude(self, img):
-        __sobelx = cv2.Sobel(img, cv2.CV_64F, 1, 0, borderType=cv2.BORDER_REFLECT)  # Find x and y gradients
-        __sobely = cv2.Sobel(img, cv2.CV_64F, 0, 1, borderType=cv2.BORDER_REFLECT)
+    def computeImageGradientMagnitude(self, img, out=None):
+        __sobelx = self.workspace.get("sobelx", np.shape(img))
+        __sobely = self.workspace.get("sobely", np.shape(img))
+        __sobelx = cv2.Sobel(img, cv2.CV_64F, 1, 0, dst=__sobelx, borderType=cv2.BORDER_REFLECT)  # Find x and y gradients
+        __sobely = cv2.Sobel(img, cv2.CV_64F, 0, 1, dst=__sobely, borderType=cv2.BORDER_REFLECT)
 
         # Find gradient magnitude
-        __magnitude = np.sqrt(__sobelx ** 2.0 + __sobely ** 2.0)
-        return(__magnitude)
+        np.multiply(__sobelx, __sobelx, out=__sobelx)
+        np.multiply(__sobely, __sobely, out=__sobely)
+        np.add(__sobelx, __sobely, out=__sobelx)
+        return(np.sqrt(__sobelx, out=out))
 
     def __computeFrequencyBands(self):
         for current_scale in self.scales:
@@ -103,8 +132,14 @@ class BlurDetector(object):
         dct_coeff = np.matmul(np.matmul(D, img_blk), np.transpose(D))
         return(dct_coeff)
 
-    def entropyFilt(self, img):
-        return(entropy(img, square(self.entropy_filt_kernel_sze)))
+    def entropyFilt(self, img, out=None):
+        if(self.__entropy is None):
+            # skimage takes longer to import than everything else together, load it on first use (or in warmUp)
+            from skimage.filters.rank import entropy
+            from skimage.morphology import square
+            self.__entropy = entropy
+            self.__footprint = square(self.entropy_filt_kernel_sze)
+        return(self.__entropy(img, self.__footprint, out=out))
 
     def computeScore(self, weighted_local_entropy, T_max):
         # normalize weighted T max matrix
@@ -116,148 +151,326 @@ class BlurDetector(object):
         score = np.median(weighted_local_entropy)
         return(score)
 
-    def TransformedDomainRecursiveFilter_Horizontal(self, I, D, sigma):
+    def computeBlurriness(self, blur_map):
+        # inverse of the mean edge strength of the normalized blur map - higher means blurrier
+        min_val = np.min(blur_map)
+        blur_map_normalized = self.workspace.get("blurriness_map", np.shape(blur_map))
+        np.subtract(blur_map, min_val, out=blur_map_normalized)
+        np.divide(blur_map_normalized, np.max(blur_map) - min_val, out=blur_map_normalized)
+        sobelx = self.workspace.get("blurriness_sobelx", np.shape(blur_map))
+        sobely = self.workspace.get("blurriness_sobely", np.shape(blur_map))
+        sobelx = cv2.Sobel(blur_map_normalized, cv2.CV_64F, 1, 0, dst=sobelx, ksize=3)
+        sobely = cv2.Sobel(blur_map_normalized, cv2.CV_64F, 0, 1, dst=sobely, ksize=3)
+        np.multiply(sobelx, sobelx, out=sobelx)
+        np.multiply(sobely, sobely, out=sobely)
+        np.add(sobelx, sobely, out=sobelx)
+        gradient_magnitude = np.sqrt(sobelx, out=sobelx)
+        return(1 / np.mean(gradient_magnitude))
+
+    def __recursiveFilterInPlace(self, F, D, V, sigma, scratch):
         # Feedback Coefficient (Appendix of the paper)
         a = np.exp(-np.sqrt(2) / sigma)
-        F = copy.deepcopy(I)
-        V = a ** D
-        rows, cols = np.shape(I)
+        np.power(a, D, out=V)
+        rows, cols = np.shape(F)
 
         # Left --> Right Filter
         for i in range(1, cols):
-            F[:, i] = F[:, i] + np.multiply(V[:, i], (F[:, i-1] - F[:, i]))
+            np.subtract(F[:, i-1], F[:, i], out=scratch)
+            np.multiply(V[:, i], scratch, out=scratch)
+            F[:, i] += scratch
 
         # Right --> Left Filter
         for i in range(cols-2, 1, -1):
-            F[:, i] = F[:, i] + np.multiply(V[:, i+1], (F[:, i + 1] - F[:, i]))
+            np.subtract(F[:, i + 1], F[:, i], out=scratch)
+            np.multiply(V[:, i+1], scratch, out=scratch)
+            F[:, i] += scratch
 
         return(F)
 
+    def TransformedDomainRecursiveFilter_Horizontal(self, I, D, sigma):
+        F = np.array(I, dtype=np.float64)
+        return(self.__recursiveFilterInPlace(F, D, np.empty(np.shape(D)), sigma, np.empty(np.shape(F)[0])))
+
     def RF(self, img, joint_img):
+        # the returned map is a workspace buffer, overwritten by the next call
         if(len(joint_img) == 0):
             joint_img = img
-        joint_img = joint_img.astype('float64')
-        joint_img = joint_img / 255
-
-        if(len(np.shape(joint_img)) == 2):
-            cols, rows = np.shape(joint_img)
-            channels = 1
-        elif(len(np.shape(joint_img)) == 3):
-            cols, rows, channels = np.shape(joint_img)
-        # Estimate horizontal and vertical partial derivatives using finite differences.
-        dIcdx = np.diff(joint_img, n=1, axis=1)
-        dIcdy = np.diff(joint_img, n=1, axis=0)
-
-        dIdx = np.zeros((cols, rows));
-        dIdy = np.zeros((cols, rows));
-
-        # Compute the l1 - norm distance of neighbor pixels.
-        dIdx[:, 1::] = abs(dIcdx)
-        dIdy[1::, :] = abs(dIcdy)
-
-        dHdx = (1 + self.sigma_s_RF_filter / self.sigma_r_RF_filter * dIdx)
-        dVdy = (1 + self.sigma_s_RF_filter / self.sigma_r_RF_filter * dIdy)
+        rows, cols = np.shape(joint_img)
+        ws = self.workspace
+        joint = ws.get("rf_joint", (rows, cols))
+        np.divide(joint_img, 255, out=joint)
+
+        # Estimate horizontal and vertical partial derivatives using finite differences and
+        # compute the l1 - norm distance of neighbor pixels.
+        dHdx = ws.get("rf_dHdx", (rows, cols))
+        dVdy = ws.get("rf_dVdy", (rows, cols))
+        # the first column/row has no neighbour - reset it, the buffers still hold the previous frame
+        dHdx[:, 0] = 0
+        np.subtract(joint[:, 1:], joint[:, :-1], out=dHdx[:, 1:])
+        np.abs(dHdx, out=dHdx)
+        dVdy[0, :] = 0
+        np.subtract(joint[1:, :], joint[:-1, :], out=dVdy[1:, :])
+        np.abs(dVdy, out=dVdy)
+
+        np.multiply(dHdx, self.sigma_s_RF_filter / self.sigma_r_RF_filter, out=dHdx)
+        dHdx += 1
+        np.multiply(dVdy, self.sigma_s_RF_filter / self.sigma_r_RF_filter, out=dVdy)
+        dVdy += 1
+
+        # the vertical passes run as horizontal passes over the transposed map
+        dVdy_T = ws.get("rf_dVdy_T", (cols, rows))
+        np.copyto(dVdy_T, dVdy.T)
+        F = ws.get("rf_F", (rows, cols))
+        F_T = ws.get("rf_F_T", (cols, rows))
+        V = ws.get("rf_V", (rows, cols))
+        V_T = ws.get("rf_V_T", (cols, rows))
+        scratch = ws.get("rf_scratch", (rows,))
+        scratch_T = ws.get("rf_scratch_T", (cols,))
 
-        dVdy = np.transpose(dVdy)
         N = self.num_iterations_RF_filter
-        F  = copy.deepcopy(img)
+        np.copyto(F, img)
         for i in range(self.num_iterations_RF_filter):
             # Compute the sigma value for this iteration (Equation 14 of our paper).
             sigma_H_i = self.sigma_s_RF_filter * np.sqrt(3) * 2 ** (N - (i + 1)) / np.sqrt(4 ** N - 1)
-            F = self.TransformedDomainRecursiveFilter_Horizontal(F, dHdx, sigma_H_i)
-            F = np.transpose(F)
+            self.__recursiveFilterInPlace(F, dHdx, V, sigma_H_i, scratch)
+            np.copyto(F_T, F.T)
 
-            F = self.TransformedDomainRecursiveFilter_Horizontal(F, dVdy, sigma_H_i)
-            F = np.transpose(F)
+            self.__recursiveFilterInPlace(F_T, dVdy_T, V_T, sigma_H_i, scratch_T)
+            np.copyto(F, F_T.T)
 
         return(F)
 
-    def detectBlur(self, img):
-        ori_rows, ori_cols = np.shape(img)
-        # perform initial gausssian smoothing
-        InputImageGaus = cv2.GaussianBlur(img, (3, 3), sigmaX=0.5, sigmaY=0.5)
-        __gradient_image = self.computeImageGradientMagnitude(InputImageGaus)
-
-        total_num_layers = 1 + sum(self.scales)
-
+    def __prepareTables(self):
+        # DCT matrices and high frequency indices only depend on the scales - compute them once per detector
+        if(len(self.__dct_matrices) > 0):
+            return
         # create all dct_matrices beforehand to save computation time
         self.__createDCT_Matrices()
 
-        # Create Frequency Labels at all the scalesv
+        # Create Frequency Labels at all the scales
         self.__computeFrequencyBands()
 
         # Compute the indices of the high frequency content inside each frequency band
-        for i in range(self.num_scales):
-            curr_freq_band = self.__freqBands[i]
-            self.freq_index.append(np.where(curr_freq_band == 0))
-
-        __padded_image = np.pad(__gradient_image, int(np.floor(max(self.scales)/2)), mode='constant')
+        self.freq_index = []
+        self.__flat_freq_index = []
+        for i, curr_scale in enumerate(self.scales):
+            index = np.where(self.__freqBands[i] == 0)
+            self.freq_index.append(index)
+            self.__flat_freq_index.append(index[0] * curr_scale + index[1])
+
+    def warmUp(self, shape=None):
+        # Do the one-time setup before the first frame arrives: DCT tables, the skimage import
+        # and, if the frame size is known, the workspace buffers for that size.
+        self.__prepareTables()
+        self.entropyFilt(np.zeros((1, 1)))
+        if(shape is not None):
+            self.detectBlurScore(np.zeros(shape, dtype=np.uint8))
+
+    def __layout(self, shape):
+        # patch centres and buffer sizes for one input resolution
+        layout = self.workspace.layouts.get(shape)
+        if(layout is None):
+            self.__prepareTables()
+            ori_rows, ori_cols = shape
+            pad = int(max(self.scales) / 2)
+            layout = {
+                "pad": pad,
+                "row_centers": np.arange(pad, ori_rows + pad, self.downsampling_factor),
+                "col_centers": np.arange(pad, ori_cols + pad, self.downsampling_factor),
+                "num_high_freq": sum(len(index) for index in self.__flat_freq_index),
+            }
+            self.workspace.layouts[shape] = layout
+        return(layout)
+
+    def computeEntropyMap(self, img):
+        # returns the downsampled weighted local entropy map, T_max and the smoothed input image
+        # all three are workspace buffers, overwritten by the next frame
+        shape = np.shape(img)
+        ori_rows, ori_cols = shape
+        layout = self.__layout(shape)
+        pad = layout["pad"]
+        col_centers = layout["col_centers"]
+        n, m = len(layout["row_centers"]), len(col_centers)
+        total_num_layers = 1 + sum(self.scales)
+        ws = self.workspace
 
-        rows, cols = np.shape(__padded_image)
-        L = []
+        # perform initial gausssian smoothing
+        InputImageGaus = ws.get("gaussian", shape, img.dtype)
+        InputImageGaus = cv2.GaussianBlur(img, (3, 3), dst=InputImageGaus, sigmaX=0.5, sigmaY=0.5)
+        # the border of the padded image is never written, so it stays zero
+        __padded_image = ws.get("padded", (ori_rows + 2 * pad, ori_cols + 2 * pad))
+        self.computeImageGradientMagnitude(InputImageGaus, out=__padded_image[pad:pad + ori_rows, pad:pad + ori_cols])
 
-        total_num_points = len([i for i in range(int(max(self.scales)/2), rows - int(max(self.scales)/2), self.downsampling_factor)]) * len([j for j in range(int(max(self.scales) / 2), cols - int(max(self.scales) / 2), self.downsampling_factor)])
-        L = np.zeros((total_num_points, total_num_layers))
+        L = ws.get("L", (n * m, total_num_layers))
+        high_freq_components = ws.get("high_freq", (m, layout["num_high_freq"]))
 
-        iter = 0
-        n = 0
+        # process one row of patch centres at a time, all columns of the row in a single batched DCT per scale
         old_progress = 0
-        for i in range(int(max(self.scales)/2), rows - int(max(self.scales)/2), self.downsampling_factor):
+        rows = len(__padded_image)
+        for n_i, i in enumerate(layout["row_centers"]):
             if(self.show_progress):
                 old_progress = self.disp_progress(i, rows, old_progress)
-            m = 0
-            n += 1
-            for j in range(int(max(self.scales) / 2), cols - int(max(self.scales) / 2), self.downsampling_factor):
-                m += 1
-                high_freq_components = []
-                for ind, curr_scale in enumerate(self.scales):
-                    Patch = __padded_image[i-int(curr_scale/2) : i+int(curr_scale/2) + 1, j-int(curr_scale/2) : j+int(curr_scale/2) + 1]
-                    dct_coefficients = np.abs(self.__getDCTCoefficients(Patch, ind))
-
-                    # store all high frequency components
-                    high_freq_components.append(dct_coefficients[self.freq_index[ind]])
-
-                # Find the first `total_num_layers` smallest values in all the high frequency components - we must not sort the entire array since that is very inefficient
-                high_freq_components = np.hstack(high_freq_components)
-                result = np.argpartition(high_freq_components, total_num_layers)
-                L[iter, :] = high_freq_components[result[:total_num_layers]]
-                iter += 1
-
-
-        L = np.array(L)
+            offset = 0
+            for ind, curr_scale in enumerate(self.scales):
+                half = int(curr_scale / 2)
+                patches = ws.get(f"patches_{ind}", (m, curr_scale, curr_scale))
+                products = ws.get(f"products_{ind}", (m, curr_scale, curr_scale))
+                # strided view of the patches centred on this row, copied without temporaries
+                windows = np.lib.stride_tricks.sliding_window_view(__padded_image[i - half:i + half + 1], (curr_scale, curr_scale))[0]
+                np.copyto(patches, windows[pad - half::self.downsampling_factor][:m])
+
+                D = self.__dct_matrices[ind]
+                np.matmul(D, patches, out=products)
+                np.matmul(products, np.transpose(D), out=patches)
+                np.abs(patches, out=patches)
+
+                # store all high frequency components
+                num_components = len(self.__flat_freq_index[ind])
+                components = ws.get(f"components_{ind}", (m, num_components))
+                np.take(patches.reshape(m, -1), self.__flat_freq_index[ind], axis=1, out=components)
+                high_freq_components[:, offset:offset + num_components] = components
+                offset += num_components
+
+            # Find the first `total_num_layers` smallest values in all the high frequency components - we must not sort the entire array since that is very inefficient
+            # argpartition keeps the element order of the per-patch version, which matters since L is normalized per column
+            result = np.argpartition(high_freq_components, total_num_layers, axis=1)
+            L[n_i * m:(n_i + 1) * m, :] = np.take_along_axis(high_freq_components, result[:, :total_num_layers], axis=1)
 
         # normalize the L matrix
-        for i in range(total_num_layers):
-            max_val = max(L[:, i])
-            L[:, i] = L[:, i] / max_val
+        L_max = ws.get("L_max", (total_num_layers,))
+        np.max(L, axis=0, out=L_max)
+        L /= L_max
 
         # perform max pooling on the normalized frequencies
-        ind1d = 0
-        T_max = np.zeros((n, m))
-        max_val = 0
-        min_val = 99999
-        for i in range(n):
-            for j in range(m):
-                T_max[i][j] = max(L[ind1d, :])
-                max_val = max(max_val, T_max[i][j])
-                min_val = min(min_val, T_max[i][j])
-                ind1d += 1
+        T_max = ws.get("T_max", (n, m))
+        np.max(L, axis=1, out=T_max.reshape(-1))
 
         # Final Map and Post Processing
-        local_entropy = self.entropyFilt(T_max)
-        weighted_local_entropy = np.multiply(local_entropy, T_max)
-
-        score = self.computeScore(weighted_local_entropy, T_max)
+        local_entropy = self.entropyFilt(T_max, out=ws.get("local_entropy", (n, m)))
+        weighted_local_entropy = np.multiply(local_entropy, T_max, out=ws.get("weighted_local_entropy", (n, m)))
+        return(weighted_local_entropy, T_max, InputImageGaus)
+
+    def computeRegionStatistics(self, weighted_local_entropy, image_shape, grid_shape=(4, 4), blur_threshold=0.3, min_region_cells=4):
+        # Summarize where a frame is out of focus, working on the downsampled map only.
+        # A map cell is blurry when its weighted local entropy is below `blur_threshold` times the
+        # frame maximum. The threshold is relative to the frame itself, so it locates the out-of-focus
+        # parts of a frame but mostly misses defocus covering the whole frame evenly - that is what the
+        # blurriness score (computeBlurriness) is for.
+        # Bounding boxes are given in pixels of the original image.
         rows, cols = np.shape(weighted_local_entropy)
+        ori_rows, ori_cols = image_shape[:2]
+        # featureless frames (lights off, lens cap) give NaN cells, which carry no detail at all
+        finite = np.isfinite(weighted_local_entropy)
+        sharpness = np.where(finite, weighted_local_entropy, 0)
+        max_val = sharpness.max()
+        if(max_val <= 0):
+            blurry = np.ones((rows, cols), dtype=bool)
+        else:
+            blurry = sharpness < blur_threshold * max_val
+
+        # per-cell mean sharpness and blurred fraction over a coarse grid
+        grid_rows, grid_cols = grid_shape
+        row_edges = np.linspace(0, rows, grid_rows + 1).astype(int)
+        col_edges = np.linspace(0, cols, grid_cols + 1).astype(int)
+        grid_sharpness = np.zeros(grid_shape)
+        grid_blurred_fraction = np.zeros(grid_shape)
+        for r in range(grid_rows):
+            for c in range(grid_cols):
+                cell = sharpness[row_edges[r]:row_edges[r + 1], col_edges[c]:col_edges[c + 1]]
+                if cell.size == 0:
+                    continue
+                grid_sharpness[r, c] = cell.mean()
+                grid_blurred_fraction[r, c] = blurry[row_edges[r]:row_edges[r + 1], col_edges[c]:col_edges[c + 1]].mean()
+
+        # connected blurry regions, map cell (i, j) is centred on image pixel (i, j) * downsampling_factor
+        num_labels, _, stats, _ = cv2.connectedComponentsWithStats(blurry.astype(np.uint8), connectivity=8)
+        regions = []
+        for label in range(1, num_labels):
+            x, y, w, h, area = stats[label]
+            if area < min_region_cells:
+                continue
+            x0 = int(x * self.downsampling_factor)
+            y0 = int(y * self.downsampling_factor)
+            regions.append({
+                "x": x0,
+                "y": y0,
+                "width": int(min(w * self.downsampling_factor, ori_cols - x0)),
+                "height": int(min(h * self.downsampling_factor, ori_rows - y0)),
+                "area_fraction": float(area) / (rows * cols),
+            })
+        regions.sort(key=lambda region: region["area_fraction"], reverse=True)
+
+        return({
+            "median_entropy": self.computeScore(weighted_local_entropy, None),
+            "grid_sharpness": grid_sharpness,
+            "grid_blurred_fraction": grid_blurred_fraction,
+            "blurred_fraction": float(blurry.mean()),
+            "regions": regions,
+        })
+
+    def detectBlurRegions(self, img, grid_shape=(4, 4), blur_threshold=0.3, min_region_cells=4):
+        # cheap alternative to detectBlur when only the location of defocus is needed - skips the RF filter and upsampling
+        weighted_local_entropy, T_max, InputImageGaus = self.computeEntropyMap(img)
+        return(self.computeRegionStatistics(weighted_local_entropy, np.shape(img), grid_shape, blur_threshold, min_region_cells))
+
+    def __finalMap(self, weighted_local_entropy, InputImageGaus, ori_rows, ori_cols, out=None):
+        rows, cols = np.shape(weighted_local_entropy)
+        ws = self.workspace
 
         # resize the input image to match the size of local_entropy matrix
-        resized_input_image = cv2.resize(InputImageGaus, (cols, rows))
-        aSmooth = cv2.GaussianBlur(resized_input_image, (3, 3), sigmaX=1, sigmaY=1)
+        resized_input_image = ws.get("resized_input", (rows, cols), InputImageGaus.dtype)
+        resized_input_image = cv2.resize(InputImageGaus, (cols, rows), dst=resized_input_image)
+        aSmooth = ws.get("smoothed_input", (rows, cols), InputImageGaus.dtype)
+        aSmooth = cv2.GaussianBlur(resized_input_image, (3, 3), dst=aSmooth, sigmaX=1, sigmaY=1)
         final_map = self.RF(weighted_local_entropy, aSmooth)
 
         # resize the map to the original resolution
-        final_map = cv2.resize(final_map, (ori_cols, ori_rows))
+        if(out is None):
+            out = np.empty((ori_rows, ori_cols))
+        out = cv2.resize(final_map, (ori_cols, ori_rows), dst=out)
 
         # normalize the map
         # final_map = final_map / np.max(final_map)
-        return(final_map)
\ No newline at end of file
+        return(out)
+
+    def detectBlur(self, img, out=None):
+        # out: optional (rows x cols) float64 array the map is written to
+        ori_rows, ori_cols = np.shape(img)
+        weighted_local_entropy, T_max, InputImageGaus = self.computeEntropyMap(img)
+        return(self.__finalMap(weighted_local_entropy, InputImageGaus, ori_rows, ori_cols, out))
+
+    def detectBlurScore(self, img, return_entropy_map=False):
+        # blurriness score of one frame, computed entirely in workspace buffers
+        # with return_entropy_map, also returns the downsampled weighted local entropy map (a workspace buffer)
+        ori_rows, ori_cols = np.shape(img)
+        weighted_local_entropy, T_max, InputImageGaus = self.computeEntropyMap(img)
+        final_map = self.__finalMap(weighted_local_entropy, InputImageGaus, ori_rows, ori_cols, self.workspace.get("final_map", (ori_rows, ori_cols)))
+        score = self.computeBlurriness(final_map)
+        if(return_entropy_map):
+            return(score, weighted_local_entropy)
+        return(score)
+
+    def detectBlurBatch(self, images, output='score'):
+        # Score a stack (N x rows x cols array) or any iterable of same-sized 2-D frames.
+        # All frames share the detector workspace and results are yielded one frame at a time,
+        # so memory use does not grow with the batch.
+        # output: 'score' - blurriness score, 'map' - full resolution blur map,
+        #         'entropy' - downsampled weighted local entropy map (skips the RF filter)
+        # validated here, outside the generator, so a bad argument fails at the call and not on the first frame
+        if(output not in ('score', 'map', 'entropy')):
+            raise ValueError("output must be one of 'score', 'map' or 'entropy'")
+        return(self.__detectBlurBatch(images, output))
+
+    def __detectBlurBatch(self, images, output):
+        shape = None
+        for img in images:
+            if(shape is None):
+                shape = np.shape(img)
+            elif(np.shape(img) != shape):
+                raise ValueError(f"All frames of a batch must have the same size, got {np.shape(img)} after {shape}")
+            if(output == 'score'):
+                yield(self.detectBlurScore(img))
+            elif(output == 'map'):
+                yield(self.detectBlur(img))
+            else:
+                yield(self.computeEntropyMap(img)[0].copy())
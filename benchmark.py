@@ -0,0 +1,168 @@
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+from BlurDetector import BlurDetector
+from src.scoring import DEFAULT_DETECTOR_KWARGS
+
+
+def synthetic_frames(num_frames, rows, cols, seed=0):
+    """
+    Generate textured grayscale frames, half of them defocused on the left side.
+    """
+    import cv2
+    rng = np.random.default_rng(seed)
+    for i in range(num_frames):
+        img = cv2.GaussianBlur((rng.random((rows, cols)) * 255).astype(np.uint8), (0, 0), 1)
+        if i % 2:
+            img[:, :cols // 2] = cv2.GaussianBlur(img[:, :cols // 2], (0, 0), 4)
+        yield img
+
+
+def _measure(detector, frames, reuse_workspace):
+    # per-frame time, traced peak allocation and garbage collections
+    gc.collect()
+    collections_before = sum(stat["collections"] for stat in gc.get_stats())
+    allocations_before = detector.workspace.allocations
+    times = []
+    peaks = []
+    tracemalloc.start()
+    for img in frames:
+        if not reuse_workspace:
+            detector.workspace.clear()
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        start_time = time.perf_counter()
+        detector.detectBlurScore(img)
+        times.append(time.perf_counter() - start_time)
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+    return {
+        "ms_per_frame": 1000 * float(np.mean(times)),
+        "peak_kib_per_frame": float(np.mean(peaks)) / 1024,
+        "gc_collections": sum(stat["collections"] for stat in gc.get_stats()) - collections_before,
+        "workspace_allocations": detector.workspace.allocations - allocations_before,
+    }
+
+
+def benchmark_workspace(rows=480, cols=640, num_frames=20, check=False, max_peak_kib=1024):
+    """
+    Compare per-frame allocations with a fresh workspace per frame (the old behaviour)
+    against a workspace reused across frames. With `check`, raise an AssertionError
+    unless the reused workspace passes check_workspace().
+    """
+    frames = list(synthetic_frames(num_frames, rows, cols))
+    detector = BlurDetector(**DEFAULT_DETECTOR_KWARGS)
+    detector.detectBlurScore(frames[0])  # warm-up: tables and buffers for this resolution
+
+    fresh = _measure(detector, frames, reuse_workspace=False)
+    detector.detectBlurScore(frames[0])
+    reused = _measure(detector, frames, reuse_workspace=True)
+
+    print(f"{num_frames} frames of {rows}x{cols}, workspace size {detector.workspace.nbytes() / 1024:.0f} KiB")
+    for name, result in (("fresh workspace", fresh), ("reused workspace", reused)):
+        print(f"  {name:17s} {result['ms_per_frame']:8.2f} ms/frame  "
+              f"{result['peak_kib_per_frame']:10.1f} KiB peak/frame  "
+              f"{result['gc_collections']:4d} gc collections  "
+              f"{result['workspace_allocations']:4d} buffer allocations")
+    if check:
+        failures = check_workspace(detector, reused, max_peak_kib)
+        assert not failures, "workspace check failed: " + "; ".join(failures)
+        print("workspace check passed")
+    return fresh, reused
+
+
+def check_workspace(detector, reused, max_peak_kib=1024):
+    """
+    Check the steady state of a reused workspace: no buffer allocations, a bounded per-frame
+    peak and no state growing from frame to frame.
+
+    Returns:
+        list: Failure messages, empty if the checks passed.
+    """
+    failures = []
+    if reused["workspace_allocations"] != 0:
+        failures.append(f"{reused['workspace_allocations']} buffer allocations in steady state, expected 0")
+    if reused["peak_kib_per_frame"] > max_peak_kib:
+        failures.append(f"{reused['peak_kib_per_frame']:.1f} KiB peak per frame, expected at most {max_peak_kib} KiB")
+    for name in ("rf_dHdx", "rf_dVdy"):
+        buffer = detector.workspace.buffers.get(name)
+        if buffer is not None and not np.isfinite(buffer).all():
+            failures.append(f"workspace buffer {name} holds non-finite values")
+    return failures
+
+
+# Runs in a fresh interpreter: time to import the service, warm a detector up and score the first frames
+_STARTUP_SNIPPET = """
+import json, time
+start_time = time.perf_counter()
+import main
+import_done = time.perf_counter()
+from benchmark import synthetic_frames
+from src.scoring import DEFAULT_DETECTOR_KWARGS, get_detector, warm_up
+frames = list(synthetic_frames(2, {rows}, {cols}))
+setup_start = time.perf_counter()
+if {warm_up}:
+    warm_up(DEFAULT_DETECTOR_KWARGS, ({rows}, {cols}))
+setup_done = time.perf_counter()
+detector = get_detector(DEFAULT_DETECTOR_KWARGS)
+detector.detectBlurScore(frames[0])
+first_done = time.perf_counter()
+detector.detectBlurScore(frames[1])
+second_done = time.perf_counter()
+print(json.dumps({{
+    "import_main": import_done - start_time,
+    "warm_up": setup_done - setup_start,
+    "first_frame": first_done - setup_done,
+    "next_frame": second_done - first_done,
+}}))
+"""
+
+
+def benchmark_startup(rows=480, cols=640, repeats=5):
+    """
+    Measure service import time, warm-up time and first-frame latency in fresh interpreters,
+    with and without the warm-up step.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    print(f"startup of {repeats} fresh interpreters, {rows}x{cols} frames (median seconds)")
+    results = {}
+    for warm in (False, True):
+        runs = []
+        for _ in range(repeats):
+            snippet = _STARTUP_SNIPPET.format(rows=rows, cols=cols, warm_up=warm)
+            output = subprocess.run([sys.executable, "-c", snippet], cwd=root, check=True,
+                                    capture_output=True, text=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        medians = {key: float(np.median([run[key] for run in runs])) for key in runs[0]}
+        results["warm_up" if warm else "no_warm_up"] = medians
+        print(f"  {'with warm-up' if warm else 'without warm-up':16s} "
+              + "  ".join(f"{key} {value:.3f}" for key, value in medians.items()))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Blur detector benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    workspace_parser = subparsers.add_parser("workspace", help="per-frame allocations with and without workspace reuse")
+    workspace_parser.add_argument("--rows", type=int, default=480)
+    workspace_parser.add_argument("--cols", type=int, default=640)
+    workspace_parser.add_argument("--frames", type=int, default=20)
+    workspace_parser.add_argument("--check", action="store_true",
+                                  help="fail unless steady-state frames allocate no buffers and stay under --max-peak-kib")
+    workspace_parser.add_argument("--max-peak-kib", type=float, default=1024)
+    startup_parser = subparsers.add_parser("startup", help="import, warm-up and first-frame time of a fresh process")
+    startup_parser.add_argument("--rows", type=int, default=480)
+    startup_parser.add_argument("--cols", type=int, default=640)
+    startup_parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.benchmark == "workspace":
+        benchmark_workspace(args.rows, args.cols, args.frames, args.check, args.max_peak_kib)
+    elif args.benchmark == "startup":
+        benchmark_startup(args.rows, args.cols, args.repeats)
@@ -1,12 +1,12 @@
 import os
 import datetime
 import time
-import psycopg2
-import threading
+from src.scheduler import DoffScheduler
 
 class FetchImage:
-    def __init__(self, db_connection):
+    def __init__(self, db_connection, doff_workers=1):
         self.conn = db_connection  # Store the database connection
+        self.doff_scheduler = DoffScheduler(self.process_doff_list, max_workers=doff_workers)
         self.roll_id = None
         self.roll_number = None
         self.roll_name = None
@@ -85,15 +85,29 @@ class FetchImage:
                 print("No active camera found.")
                 return None
 
+    def fetch_active_cameras(self):
+        """Fetches the names of all cameras in cam_details where camsts_id is 1."""
+        query = """
+        SELECT cam_name
+        FROM cam_details
+        WHERE camsts_id::int = 1
+        ORDER BY cam_name ASC
+        """
+        with self.conn.cursor() as cursor:
+            cursor.execute(query)
+            return [row[0] for row in cursor.fetchall()]
 
-    def fetch_images_from_directory(self):
-        """Fetches image paths from the specified input directory."""
-        if not all([self.roll_id, self.camera_name]):
+
+    def fetch_images_from_directory(self, roll_id=None, camera_name=None):
+        """Fetches image paths from the input directory of the given (default: current) roll and camera."""
+        roll_id = roll_id or self.roll_id
+        camera_name = camera_name or self.camera_name
+        if not all([roll_id, camera_name]):
             print("Missing roll ID or camera name, unable to fetch images.")
             return []
 
         # Construct the directory path
-        self.input_dir = f"/home/kniti/projects/knit-i/knitting-core/images/{self.roll_id}/{datetime.datetime.now().date()}/{self.camera_name}/cam1/{datetime.datetime.now().hour}/"
+        self.input_dir = self.image_directory(roll_id, camera_name)
         
         print(f"Looking for images in: {self.input_dir}")  # Print the directory being checked
         
@@ -108,8 +122,21 @@ class FetchImage:
             print(f"Image path: {img}")  # Print each image path
         return images
 
+    def image_directory(self, roll_id, camera_name, now=None):
+        """Returns the directory the knitting core writes the current hour's images of a camera to."""
+        now = now or datetime.datetime.now()
+        return f"/home/kniti/projects/knit-i/knitting-core/images/{roll_id}/{now.date()}/{camera_name}/cam1/{now.hour}/"
+
     def monitor_roll_changes(self, active_camera_names):
         """Continuously monitors roll details for changes and triggers processing when needed."""
+        self.doff_scheduler.start()
+        try:
+            self._monitor_roll_changes(active_camera_names)
+        finally:
+            self.doff_scheduler.shutdown(wait=True)
+            print(f"Doff scheduler metrics: {self.doff_scheduler.metrics()}")
+
+    def _monitor_roll_changes(self, active_camera_names):
         updated_doff_list = []
 
         while True:
@@ -133,20 +160,18 @@ class FetchImage:
                     continue
 
                 if current_roll_id != self.previous_data["roll_id"] and len(updated_doff_list) > 1:
-                    threading.Thread(
-                        target=self.process_doff_list, 
-                        args=(updated_doff_list, self.previous_data["roll_id"], active_camera_names)
-                    ).start()
+                    self.doff_scheduler.submit(
+                        updated_doff_list, self.previous_data["roll_id"], active_camera_names, current=False
+                    )
                     updated_doff_list = []
                     self.previous_data["roll_id"] = current_roll_id
 
                 updated_doff_list.append(current_doff)
 
                 if current_doff % 100 == 0 and len(updated_doff_list) > 1:
-                    threading.Thread(
-                        target=self.process_doff_list, 
-                        args=(updated_doff_list, self.previous_data["roll_id"], active_camera_names)
-                    ).start()
+                    self.doff_scheduler.submit(
+                        updated_doff_list, self.previous_data["roll_id"], active_camera_names, current=True
+                    )
                     updated_doff_list = []
 
             else:
@@ -1,89 +1,82 @@
-import cv2
-import numpy as np
+import asyncio
 import os
-import time
-from BlurDetector import BlurDetector
 from fetch import FetchImage  # Import FetchImage for database operations
-from tqdm import tqdm
+from src.archive import BlurMapArchive
+from src.calibration import CalibrationCache
 from src.db import Database  # Import your Database class
+from src.scoring import DEFAULT_DETECTOR_KWARGS, read_jpeg_shape
+from src.service import ArchiveSink, BlurService, ConsoleSink, LogFileSink
+from src.throttle import CpuBudgetController
 
 class BlurMain:
-    def __init__(self):
+    def __init__(self, max_workers=2, frame_shape=None):
         # Initialize Database connection without a path
         self.database = Database()  # Create a Database instance
         self.fetcher = FetchImage(self.database.conn)  # Pass the database connection to FetchImage
 
-    def run_blur_detection(self):
-        """
-        Continuously run blur detection by fetching images from the directory.
+        # Camera frame size (rows, cols), lets the scoring workers allocate their buffers before the first frame
+        self.frame_shape = frame_shape or self.detect_frame_shape()
+        if self.frame_shape is None:
+            print("Frame size unknown, the first frame of each scoring worker will allocate its buffers")
+
+        log_file_path = "/home/kniti/Documents/focus/Focus_detection/log/log.txt"  # Update this to the desired log path
+        # Per-camera and per-roll baselines of sharp frames, learned while running and reloaded on restart;
+        # self.calibration.clear(camera) makes a camera warm up again, e.g. after refocusing it
+        self.calibration = CalibrationCache("/home/kniti/Documents/focus/Focus_detection/log/calibration.json")
+        print(f"Loaded {self.calibration.load()} calibrated baselines")
+        # Downsampled blur map and score of every scored frame, for post-hoc analysis without re-running the detector
+        self.archive = BlurMapArchive("/home/kniti/Documents/focus/Focus_detection/archive")
+        # Blur detection shares the machine with the defect pipeline: stay within a quarter of the CPU
+        # by sampling fewer frames, idling workers and finally using cheaper detector parameters
+        self.controller = CpuBudgetController(DEFAULT_DETECTOR_KWARGS, max_workers, cpu_share=0.25, latency_target=3.0)
+        self.service = BlurService(
+            self.fetcher,
+            detector_kwargs=DEFAULT_DETECTOR_KWARGS,
+            sinks=[ConsoleSink(), LogFileSink(log_file_path), ArchiveSink(self.archive)],
+            max_workers=max_workers,
+            # score every 10th frame, every 2nd-3rd while scores trend or approach the threshold,
+            # and at least one frame per revolution
+            sampling={"mode": "adaptive", "every_nth": 10, "boost": 4, "min_per_revolution": 1},
+            calibration=self.calibration,
+            return_maps=True,
+            controller=self.controller,
+            warmup_shape=self.frame_shape,
+        )
+
+    def detect_frame_shape(self):
         """
-        while True:
-            # Fetch roll and camera details from the database
-            roll_details = self.fetcher.fetch_roll_details()  # Gets roll_name, roll_number, revolution
-            cam_name = self.fetcher.fetch_cam_name()
-            
-            print(roll_details)
-            print("------------------------------------------") 
-            print(cam_name)         # Gets cam_name
+        Read the frame size from the newest image of the active cameras.
 
-            if roll_details is None or cam_name is None:
-                print("No valid roll or camera details found. Retrying...")
-                time.sleep(5)  # Retry interval
+        Returns:
+            tuple: (rows, cols), or None if no image could be found.
+        """
+        try:
+            self.fetcher.fetch_roll_details()
+            cameras = self.fetcher.fetch_active_cameras()
+        except Exception as e:
+            print(f"Failed to fetch roll and camera details: {e}")
+            return None
+        if self.fetcher.roll_id is None:
+            return None
+        for cam_name in cameras:
+            folder_path = self.fetcher.image_directory(self.fetcher.roll_id, cam_name)
+            if not os.path.isdir(folder_path):
                 continue
-
-            roll_id = roll_details['roll_name']  # Extract roll_id
-            folder_path = self.fetcher.fetch_images_from_directory(roll_id, cam_name)  # Construct image directory
-
-            if not folder_path:
-                print("No valid directory found. Retrying...")
-                time.sleep(5)  # Retry interval
+            images = [entry for entry in os.scandir(folder_path) if entry.name.endswith(".jpg")]
+            if not images:
                 continue
+            newest = max(images, key=lambda entry: entry.stat().st_mtime)
+            shape = read_jpeg_shape(newest.path)
+            if shape is not None:
+                print(f"Frame size {shape[0]}x{shape[1]} from {newest.path}")
+                return shape
+        return None
 
-            blur_detector = BlurDetector(
-                downsampling_factor=4,
-                num_scales=3,
-                scale_start=2,
-                entropy_filt_kernel_sze=7,
-                sigma_s_RF_filter=15,
-                sigma_r_RF_filter=0.25,
-                num_iterations_RF_filter=3,
-                show_progress=False,
-            )
-
-            blurriness_scores = []
-            start_time = time.time()
-
-            # Iterate over images in the dynamically fetched folder path
-            for filename in tqdm(os.listdir(folder_path)):
-                if filename.endswith(".jpg"):
-                    img_path = os.path.join(folder_path, filename)
-                    img = cv2.imread(img_path, 0)
-
-                    map = blur_detector.detectBlur(img)
-                    blur_map_normalized = (map - np.min(map)) / (np.max(map) - np.min(map))
-                    sobelx = cv2.Sobel(blur_map_normalized, cv2.CV_64F, 1, 0, ksize=3)
-                    sobely = cv2.Sobel(blur_map_normalized, cv2.CV_64F, 0, 1, ksize=3)
-                    gradient_magnitude = np.sqrt(sobelx**2 + sobely**2)
-                    blurriness_score = 1 / np.mean(gradient_magnitude)
-                    blurriness_scores.append(blurriness_score)
-
-                    print(f'Image: {filename}, Blurriness Score: {blurriness_score}')
-
-            print(f"Time taken: {time.time() - start_time} seconds")
-
-            # Calculate and log average blurriness score
-            avg_blurriness = np.mean(blurriness_scores)
-            if avg_blurriness > 175:
-                result = f"The folder {folder_path} contains mostly blurry images with a blurriness score of {avg_blurriness}."
-            else:
-                result = f"The folder {folder_path} does not contain mostly blurry images, with a blurriness score of {avg_blurriness}."
-
-            log_file_path = "/home/kniti/Documents/focus/Focus_detection/log/log.txt"  # Update this to the desired log path
-            with open(log_file_path, "a") as log_file:
-                log_file.write(result + "\n")
-
-            print(result)
-            time.sleep(10)  # Adjust sleep time as necessary
+    def run_blur_detection(self):
+        """
+        Continuously run blur detection on the images of all active cameras until interrupted.
+        """
+        asyncio.run(self.service.run())
 
 
 # Example usage
@@ -0,0 +1,236 @@
+import argparse
+import concurrent.futures
+import csv
+import json
+import math
+import os
+import sys
+import time
+from src.scoring import DEFAULT_DETECTOR_KWARGS, score_image
+
+FIELDS = ["path", "score", "blurry", "elapsed", "error"]
+
+
+def iter_images(paths, file_lists, extensions):
+    """
+    Yield image paths from files, directory trees and file lists, in a stable order.
+    """
+    for file_list in file_lists:
+        with open(file_list) as list_file:
+            for line in list_file:
+                line = line.strip()
+                if line:
+                    yield line
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if filename.lower().endswith(extensions):
+                        yield os.path.join(dirpath, filename)
+        else:
+            yield path
+
+
+class Checkpoint:
+    """
+    Set of image paths whose results are already written, persisted as one path per line.
+
+    Paths are recorded only after their rows have been flushed to the output, so an
+    interrupted run resumes without losing results. A crash between the two writes can
+    at most duplicate the rows of one flush.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as checkpoint_file:
+                self.done = set(line.rstrip("\n") for line in checkpoint_file if line.strip())
+
+    def add(self, image_paths):
+        with open(self.path, "a") as checkpoint_file:
+            checkpoint_file.writelines(image_path + "\n" for image_path in image_paths)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        self.done.update(image_paths)
+
+
+class ResultWriter:
+    """
+    Append result rows to a CSV or JSONL file, or to a directory of Parquet part files.
+    """
+
+    def __init__(self, output, output_format):
+        self.output = output
+        self.output_format = output_format
+        if output_format == "parquet":
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                sys.exit("Parquet output needs pyarrow (pip install pyarrow).")
+            self._pyarrow = pyarrow
+            self._parquet = pyarrow.parquet
+            # explicit, so a part holding only unreadable images does not get null-typed columns
+            self._schema = pyarrow.schema([
+                ("path", pyarrow.string()),
+                ("score", pyarrow.float64()),
+                ("blurry", pyarrow.bool_()),
+                ("elapsed", pyarrow.float64()),
+                ("error", pyarrow.string()),
+            ])
+            os.makedirs(output, exist_ok=True)
+
+    def write(self, rows):
+        if not rows:
+            return
+        if self.output_format == "csv":
+            new_file = not os.path.exists(self.output) or os.path.getsize(self.output) == 0
+            with open(self.output, "a", newline="") as output_file:
+                writer = csv.DictWriter(output_file, fieldnames=FIELDS)
+                if new_file:
+                    writer.writeheader()
+                writer.writerows(rows)
+                self._sync(output_file)
+        elif self.output_format == "jsonl":
+            with open(self.output, "a") as output_file:
+                output_file.writelines(json.dumps(row, allow_nan=False) + "\n" for row in rows)
+                self._sync(output_file)
+        else:
+            # Parquet files cannot be appended to, every flush becomes a new part file
+            part = len([name for name in os.listdir(self.output) if name.endswith(".parquet")])
+            table = self._pyarrow.Table.from_pylist(rows, schema=self._schema)
+            self._parquet.write_table(table, os.path.join(self.output, f"part-{part:05d}.parquet"))
+
+    def _sync(self, output_file):
+        output_file.flush()
+        os.fsync(output_file.fileno())
+
+
+def run(args):
+    detector_kwargs = dict(DEFAULT_DETECTOR_KWARGS)
+    detector_kwargs.update({
+        "downsampling_factor": args.downsampling_factor,
+        "num_scales": args.num_scales,
+        "scale_start": args.scale_start,
+        "entropy_filt_kernel_sze": args.entropy_kernel,
+        "sigma_s_RF_filter": args.sigma_s,
+        "sigma_r_RF_filter": args.sigma_r,
+        "num_iterations_RF_filter": args.rf_iterations,
+    })
+    checkpoint = Checkpoint(args.checkpoint or args.output + ".checkpoint")
+    writer = ResultWriter(args.output, args.format)
+    extensions = tuple(ext if ext.startswith(".") else "." + ext for ext in args.extensions.lower().split(","))
+    pending_paths = (path for path in iter_images(args.paths, args.file_list, extensions) if path not in checkpoint.done)
+    if checkpoint.done:
+        print(f"Resuming: {len(checkpoint.done)} images already scored.")
+
+    rows = []
+    processed = 0
+    retry_later = 0
+    start_time = time.time()
+    last_report = start_time
+
+    def collect(image_path, result):
+        nonlocal processed, last_report
+        if result is None:
+            # unreadable images fail the same way every time, record them instead of retrying
+            rows.append({"path": image_path, "score": None, "blurry": None, "elapsed": None,
+                         "error": "unreadable image"})
+        else:
+            # a featureless frame scores NaN: blurry, like everywhere else, and written as a missing score
+            finite = math.isfinite(result["score"])
+            rows.append({"path": image_path, "score": result["score"] if finite else None,
+                         "blurry": not finite or result["score"] > args.blur_threshold,
+                         "elapsed": result["elapsed"], "error": None})
+        processed += 1
+        if len(rows) >= args.flush_every:
+            flush()
+        now = time.time()
+        if now - last_report >= args.report_interval:
+            print(f"{processed} images, {processed / (now - start_time):.2f} images/s")
+            last_report = now
+
+    def fail(image_path, error):
+        # anything else may be transient (e.g. a worker killed for memory): neither written nor
+        # checkpointed, so the next run retries the image
+        nonlocal retry_later
+        print(f"Failed to score {image_path}: {error}")
+        retry_later += 1
+
+    def flush():
+        writer.write(rows)
+        checkpoint.add([row["path"] for row in rows])
+        rows.clear()
+
+    try:
+        if args.workers <= 1:
+            for image_path in pending_paths:
+                try:
+                    collect(image_path, score_image(image_path, detector_kwargs))
+                except Exception as e:
+                    fail(image_path, e)
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+                # keep a bounded number of images in flight instead of submitting the whole tree
+                in_flight = {}
+                for image_path in pending_paths:
+                    in_flight[executor.submit(score_image, image_path, detector_kwargs)] = image_path
+                    if len(in_flight) >= 4 * args.workers:
+                        done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                        for future in done:
+                            image_path = in_flight.pop(future)
+                            try:
+                                collect(image_path, future.result())
+                            except Exception as e:
+                                fail(image_path, e)
+                for future in concurrent.futures.as_completed(list(in_flight)):
+                    image_path = in_flight.pop(future)
+                    try:
+                        collect(image_path, future.result())
+                    except Exception as e:
+                        fail(image_path, e)
+    except KeyboardInterrupt:
+        print("Interrupted, saving progress...")
+    except concurrent.futures.BrokenExecutor as e:
+        print(f"Scoring workers died ({e}), saving progress. Images in flight are retried on the next run.")
+    finally:
+        flush()
+
+    elapsed = time.time() - start_time
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    print(f"Scored {processed} images in {elapsed:.1f} s ({rate:.2f} images/s), results in {args.output}")
+    if retry_later:
+        print(f"{retry_later} images failed and will be retried on the next run.")
+        return 1
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Score images for blur offline, without the database.")
+    parser.add_argument("paths", nargs="*", help="image files or directories (searched recursively)")
+    parser.add_argument("--file-list", action="append", default=[], help="text file with one image path per line")
+    parser.add_argument("--extensions", default=".jpg", help="comma-separated image extensions (default: .jpg)")
+    parser.add_argument("-o", "--output", required=True, help="output file, or directory for parquet")
+    parser.add_argument("--format", choices=["csv", "jsonl", "parquet"], default="csv")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <output>.checkpoint)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--flush-every", type=int, default=100, help="rows per output flush and checkpoint")
+    parser.add_argument("--report-interval", type=float, default=10, help="seconds between progress reports")
+    parser.add_argument("--blur-threshold", type=float, default=175)
+    parser.add_argument("--downsampling-factor", type=int, default=DEFAULT_DETECTOR_KWARGS["downsampling_factor"])
+    parser.add_argument("--num-scales", type=int, default=DEFAULT_DETECTOR_KWARGS["num_scales"])
+    parser.add_argument("--scale-start", type=int, default=DEFAULT_DETECTOR_KWARGS["scale_start"])
+    parser.add_argument("--entropy-kernel", type=int, default=DEFAULT_DETECTOR_KWARGS["entropy_filt_kernel_sze"])
+    parser.add_argument("--sigma-s", type=float, default=DEFAULT_DETECTOR_KWARGS["sigma_s_RF_filter"])
+    parser.add_argument("--sigma-r", type=float, default=DEFAULT_DETECTOR_KWARGS["sigma_r_RF_filter"])
+    parser.add_argument("--rf-iterations", type=int, default=DEFAULT_DETECTOR_KWARGS["num_iterations_RF_filter"])
+    args = parser.parse_args(argv)
+    if not args.paths and not args.file_list:
+        parser.error("give at least one path or --file-list")
+    return args
+
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
@@ -0,0 +1,175 @@
+import glob
+import os
+import time
+import numpy as np
+from src.scoring import detector_label
+
+# One fixed-size record per archived frame; `offset` is the byte offset of the map in maps.f32
+INDEX_DTYPE = np.dtype([
+    ("offset", "<i8"),
+    ("rows", "<i4"),
+    ("cols", "<i4"),
+    ("score", "<f8"),
+    ("timestamp", "<f8"),
+    ("name", "S64"),
+])
+MAP_DTYPE = np.dtype("<f4")
+
+
+class BlurMapArchive:
+    """
+    Append-only archive of downsampled blur maps and scores.
+
+    Frames are grouped in segments, one directory per roll, camera, hour and detector
+    parameters (see src.scoring.detector_label):
+
+        <root>/<roll_id>/<camera>/<YYYY-MM-DD_HH>/<detector>/maps.f32   raw float32 maps, back to back
+        <root>/<roll_id>/<camera>/<YYYY-MM-DD_HH>/<detector>/index.bin  one INDEX_DTYPE record per map
+
+    Scores and map sizes depend on the detector parameters, so frames scored with
+    different parameters (e.g. while the CPU budget controller throttles) never share
+    a segment.
+
+    The map is written before its index record, so a reader never sees a record
+    whose map is incomplete. There must be a single writer per segment.
+    """
+
+    def __init__(self, root):
+        """
+        Args:
+            root (str): Directory holding the archive.
+        """
+        self.root = root
+
+    def segment_path(self, roll_id, camera, timestamp, detector_kwargs=None):
+        hour = time.strftime("%Y-%m-%d_%H", time.localtime(timestamp))
+        return os.path.join(self.root, str(roll_id), str(camera), hour, detector_label(detector_kwargs))
+
+    def append(self, roll_id, camera, blur_map, score, timestamp=None, name="", detector_kwargs=None):
+        """
+        Append one frame to the segment of its roll, camera and hour.
+
+        Args:
+            roll_id: Roll the frame belongs to.
+            camera (str): Camera name.
+            blur_map (numpy.ndarray): 2-D downsampled blur map, stored as float32.
+            score (float): Score of the frame.
+            timestamp (float): Capture time in seconds since the epoch, now if None.
+            name (str): Frame name, typically the image file name (at most 64 bytes are kept).
+            detector_kwargs (dict): Detector parameters the frame was scored with, the defaults if None.
+
+        Returns:
+            str: The segment directory.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        segment_dir = self.segment_path(roll_id, camera, timestamp, detector_kwargs)
+        os.makedirs(segment_dir, exist_ok=True)
+        data = np.ascontiguousarray(blur_map, dtype=MAP_DTYPE)
+        rows, cols = data.shape
+
+        with open(os.path.join(segment_dir, "maps.f32"), "ab") as maps_file:
+            maps_file.seek(0, os.SEEK_END)
+            offset = maps_file.tell()
+            maps_file.write(data)
+        record = np.array([(offset, rows, cols, score, timestamp, name.encode()[:64])], dtype=INDEX_DTYPE)
+        with open(os.path.join(segment_dir, "index.bin"), "ab") as index_file:
+            index_file.write(record)
+        return segment_dir
+
+    def segments(self, roll_id="*", camera="*", hour="*", detector="*"):
+        """
+        List segment directories, optionally filtered by roll, camera, hour and detector label (glob patterns).
+
+        Returns:
+            list: Sorted segment directories.
+        """
+        pattern = os.path.join(self.root, str(roll_id), str(camera), hour, detector)
+        return sorted(path for path in glob.glob(pattern) if os.path.exists(os.path.join(path, "index.bin")))
+
+    def open(self, segment_dir):
+        """Open a segment for reading."""
+        return ArchiveSegment(segment_dir)
+
+
+class ArchiveSegment:
+    """
+    Read-only, memory-mapped view of one archive segment.
+
+    Scores, index fields and maps are NumPy views of the mapped files, nothing is copied
+    until it is modified or reduced.
+    """
+
+    def __init__(self, segment_dir):
+        self.path = segment_dir
+        self.detector = os.path.basename(os.path.normpath(segment_dir))
+        index_path = os.path.join(segment_dir, "index.bin")
+        maps_path = os.path.join(segment_dir, "maps.f32")
+        # ignore a trailing partial record left by an interrupted writer
+        num_records = os.path.getsize(index_path) // INDEX_DTYPE.itemsize
+        maps_size = os.path.getsize(maps_path) if os.path.exists(maps_path) else 0
+        if num_records == 0 or maps_size == 0:
+            self.index = np.zeros(0, dtype=INDEX_DTYPE)
+            self.data = np.zeros(0, dtype=MAP_DTYPE)
+            return
+        self.index = np.memmap(index_path, dtype=INDEX_DTYPE, mode="r", shape=(num_records,))
+        self.data = np.memmap(maps_path, dtype=MAP_DTYPE, mode="r", shape=(maps_size // MAP_DTYPE.itemsize,))
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def scores(self):
+        return self.index["score"]
+
+    @property
+    def timestamps(self):
+        return self.index["timestamp"]
+
+    @property
+    def names(self):
+        return [name.decode() for name in self.index["name"]]
+
+    def map(self, i):
+        """Return the i-th map as a zero-copy (rows x cols) view."""
+        record = self.index[i]
+        start = int(record["offset"]) // MAP_DTYPE.itemsize
+        return self.data[start:start + int(record["rows"]) * int(record["cols"])].reshape(int(record["rows"]), int(record["cols"]))
+
+    def stack(self):
+        """
+        Return all maps as one zero-copy (N x rows x cols) view.
+
+        Raises:
+            ValueError: If the maps of the segment do not all have the same size.
+        """
+        if len(self) == 0:
+            return np.zeros((0, 0, 0), dtype=MAP_DTYPE)
+        rows, cols = int(self.index["rows"][0]), int(self.index["cols"][0])
+        map_bytes = rows * cols * MAP_DTYPE.itemsize
+        expected_offsets = self.index["offset"][0] + map_bytes * np.arange(len(self))
+        if not (np.all(self.index["rows"] == rows) and np.all(self.index["cols"] == cols)
+                and np.array_equal(self.index["offset"], expected_offsets)):
+            raise ValueError(f"Maps in {self.path} differ in size, use map(i) instead.")
+        start = int(self.index["offset"][0]) // MAP_DTYPE.itemsize
+        return self.data[start:start + len(self) * rows * cols].reshape(len(self), rows, cols)
+
+    def rethreshold(self, blur_threshold=0.3):
+        """
+        Fraction of each map below `blur_threshold` times that map's maximum,
+        the same rule as BlurDetector.computeRegionStatistics: non-finite cells count as
+        blurred, and so does every cell of a map without any positive value.
+
+        Returns:
+            numpy.ndarray: Blurred fraction per frame.
+        """
+        maps = self.stack()
+        if len(maps) == 0:
+            return np.zeros(0)
+        sharpness = np.where(np.isfinite(maps), maps, 0)
+        limits = blur_threshold * sharpness.max(axis=(1, 2))
+        blurred = (sharpness < limits[:, None, None]) | (limits <= 0)[:, None, None]
+        return blurred.mean(axis=(1, 2))
+
+    def mean_map(self):
+        """Return the per-cell mean over all maps of the segment."""
+        return self.stack().mean(axis=0, dtype=np.float64)
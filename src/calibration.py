@@ -0,0 +1,217 @@
+import json
+import math
+import os
+import threading
+
+
+class CalibrationCache:
+    """
+    Per-camera / per-fabric baselines of the blurriness score of sharp frames.
+
+    Each baseline is an exponentially weighted mean and variance of the scores of
+    recent frames judged sharp. Once a baseline has seen `min_samples` frames, a
+    frame is blurry when its score is more than `blur_z` standard deviations above
+    the baseline mean; before that the global `fallback_threshold` is used. The
+    baselines are kept in a small JSON file so they survive restarts.
+
+    A warm baseline only learns scores within `learn_z` standard deviations of its
+    mean, and its mean never rises more than `max_drift` standard deviations above
+    its value at the end of the warm-up, so a slow defocus drift cannot become the
+    new normal. Non-finite scores (featureless frames) are blurry and never learned.
+    A step change of the sharp scores (another fabric, lighting) is not learned
+    either: when a warm baseline judges at least `rewarm_fraction` of
+    `rewarm_window` consecutive frames blurry, it is dropped and warms up again
+    under the fallback threshold. clear() drops baselines on demand.
+
+    Keys are "<camera>" or "<camera>/<fabric>"; a camera may carry an "@<variant>"
+    suffix for baselines of other detector parameters.
+    """
+
+    def __init__(self, path=None, min_samples=30, alpha=0.02, blur_z=3.0, min_std=1.0, fallback_threshold=175,
+                 learn_z=1.0, max_drift=1.0, rewarm_window=300, rewarm_fraction=0.9):
+        """
+        Args:
+            path (str): JSON file the baselines are loaded from and saved to, None to keep them in memory.
+            min_samples (int): Sharp frames needed before a baseline is used.
+            alpha (float): Weight of a new score once the baseline is warmed up.
+            blur_z (float): Standard deviations above the baseline mean at which a frame is blurry.
+            min_std (float): Lower bound of the baseline standard deviation.
+            fallback_threshold (float): Global blurriness threshold for uncalibrated cameras.
+            learn_z (float): Standard deviations around the mean within which a warm baseline learns.
+            max_drift (float): Standard deviations the mean may rise above its value at the end of the warm-up.
+            rewarm_window (int): Calibrated frames over which the blurry fraction is checked.
+            rewarm_fraction (float): Blurry fraction of a window at which the baseline warms up again.
+        """
+        self.path = path
+        self.min_samples = min_samples
+        self.alpha = alpha
+        self.blur_z = blur_z
+        self.min_std = min_std
+        self.fallback_threshold = fallback_threshold
+        self.learn_z = learn_z
+        self.max_drift = max_drift
+        self.rewarm_window = rewarm_window
+        self.rewarm_fraction = rewarm_fraction
+        # variance of a normal distribution truncated to +-learn_z standard deviations, relative to the full one
+        density = math.exp(-learn_z * learn_z / 2) / math.sqrt(2 * math.pi)
+        self._truncated_var_ratio = 1 - 2 * learn_z * density / math.erf(learn_z / math.sqrt(2))
+        self.baselines = {}  # key -> {"count", "mean", "var"} and, once warm, "warm_mean", "warm_std"
+        self._windows = {}   # key -> [calibrated frames, blurry frames] of the current rewarm window
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(camera, fabric=None):
+        return f"{camera}/{fabric}" if fabric is not None else str(camera)
+
+    def load(self):
+        """
+        Load the baselines from `path`. A missing or unreadable file leaves the cache empty.
+
+        Returns:
+            int: Number of baselines loaded.
+        """
+        if self.path is None or not os.path.exists(self.path):
+            return 0
+        try:
+            with open(self.path) as cache_file:
+                baselines = json.load(cache_file)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring calibration cache {self.path}: {e}")
+            return 0
+        loaded = {}
+        for key, value in baselines.items():
+            baseline = {field: float(value[field]) for field in ("mean", "var", "warm_mean", "warm_std") if field in value}
+            if not all(math.isfinite(number) for number in baseline.values()):
+                print(f"Ignoring corrupt calibration baseline {key}: {value}")
+                continue
+            baseline["count"] = int(value["count"])
+            if baseline["count"] >= self.min_samples and "warm_mean" not in baseline:
+                # saved before the drift limit existed, anchor it where it stands
+                baseline["warm_mean"] = baseline["mean"]
+                baseline["warm_std"] = max(math.sqrt(baseline["var"]), self.min_std)
+            loaded[key] = baseline
+        with self._lock:
+            self.baselines = loaded
+            return len(self.baselines)
+
+    def save(self):
+        """
+        Atomically write the baselines to `path`.
+        """
+        if self.path is None:
+            return
+        with self._lock:
+            snapshot = json.dumps(self.baselines, separators=(",", ":"), sort_keys=True)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as cache_file:
+            cache_file.write(snapshot)
+        os.replace(tmp_path, self.path)
+
+    def threshold(self, camera, fabric=None):
+        """
+        Return the blurriness score above which a frame of this camera and fabric is blurry.
+
+        Returns:
+            tuple: (threshold, calibrated)
+        """
+        with self._lock:
+            baseline = self.baselines.get(self.key(camera, fabric))
+            if baseline is None or baseline["count"] < self.min_samples:
+                return self.fallback_threshold, False
+            std = max(math.sqrt(baseline["var"]), self.min_std)
+            return baseline["mean"] + self.blur_z * std, True
+
+    def verdict(self, camera, score, fabric=None):
+        """
+        Judge one frame against the baseline of its camera and fabric.
+
+        Returns:
+            dict: blurry flag, threshold used and whether the baseline was calibrated.
+        """
+        threshold, calibrated = self.threshold(camera, fabric)
+        # a featureless frame (lights off, lens cap) scores NaN and shows nothing in focus
+        return {"blurry": not math.isfinite(score) or score > threshold, "threshold": threshold, "calibrated": calibrated}
+
+    def update(self, camera, score, fabric=None):
+        """
+        Add the score of a sharp frame to the baseline of its camera and fabric.
+
+        Returns:
+            bool: True if the score was learned, False if it is non-finite or, once the
+                baseline is warm, further than `learn_z` standard deviations from its mean.
+        """
+        if not math.isfinite(score):
+            return False
+        key = self.key(camera, fabric)
+        with self._lock:
+            baseline = self.baselines.setdefault(key, {"count": 0, "mean": 0.0, "var": 0.0})
+            warm = baseline["count"] >= self.min_samples
+            delta = score - baseline["mean"]
+            if warm and abs(delta) > self.learn_z * max(math.sqrt(baseline["var"]), self.min_std):
+                return False
+            baseline["count"] += 1
+            # plain running mean/variance while warming up, exponential forgetting afterwards
+            weight = max(self.alpha, 1.0 / baseline["count"])
+            # a warm baseline only sees the middle of the distribution, scale its spread back up
+            spread = delta * delta / self._truncated_var_ratio if warm else delta * delta
+            baseline["mean"] += weight * delta
+            baseline["var"] = (1 - weight) * (baseline["var"] + weight * spread)
+            if baseline["count"] == self.min_samples:
+                baseline["warm_mean"] = baseline["mean"]
+                baseline["warm_std"] = max(math.sqrt(baseline["var"]), self.min_std)
+            elif warm:
+                baseline["mean"] = min(baseline["mean"], baseline["warm_mean"] + self.max_drift * baseline["warm_std"])
+            return True
+
+    def observe(self, camera, score, fabric=None):
+        """
+        Judge a frame and learn from it if it is sharp.
+
+        Returns:
+            dict: The verdict, see verdict().
+        """
+        verdict = self.verdict(camera, score, fabric)
+        if not verdict["blurry"]:
+            self.update(camera, score, fabric)
+        if verdict["calibrated"]:
+            self._check_rewarm(self.key(camera, fabric), verdict["blurry"])
+        return verdict
+
+    def _check_rewarm(self, key, blurry):
+        with self._lock:
+            window = self._windows.setdefault(key, [0, 0])
+            window[0] += 1
+            window[1] += blurry
+            if window[0] < self.rewarm_window:
+                return
+            del self._windows[key]
+            if window[1] < self.rewarm_fraction * window[0]:
+                return
+            self.baselines.pop(key, None)
+        print(f"Calibration {key}: {window[1]} of the last {window[0]} frames were blurry, warming up again")
+
+    def clear(self, camera=None, fabric=None):
+        """
+        Drop baselines so they warm up again.
+
+        Args:
+            camera (str): Camera whose baselines (all fabrics and variants) are dropped, all cameras if None.
+            fabric: Fabric whose baselines are dropped, all fabrics if None.
+
+        Returns:
+            int: Number of baselines dropped.
+        """
+        with self._lock:
+            dropped = []
+            for key in self.baselines:
+                key_camera, _, key_fabric = key.partition("/")
+                if camera is not None and key_camera.split("@")[0] != str(camera):
+                    continue
+                if fabric is not None and key_fabric != str(fabric):
+                    continue
+                dropped.append(key)
+            for key in dropped:
+                del self.baselines[key]
+                self._windows.pop(key, None)
+            return len(dropped)
@@ -0,0 +1,125 @@
+from collections import deque
+
+
+class FrameSampler:
+    """
+    Decide which frames of a camera are scored.
+
+    Modes:
+        all: score every frame.
+        every_nth: score one frame out of every `every_nth`.
+        rate: score at most one frame every `min_interval` seconds of frame time.
+        adaptive: like every_nth, but `boost` times denser while the recent scores are
+            trending or close to the blur threshold.
+
+    Whatever the mode, the first `min_per_revolution` frames of every revolution are
+    scored, so each revolution is covered even at the sparsest rate. `scale` stretches
+    the sampling period and interval, e.g. when CPU is short.
+    """
+
+    MODES = ("all", "every_nth", "rate", "adaptive")
+
+    def __init__(self, mode="adaptive", every_nth=10, min_interval=2.0, threshold=175, margin=25,
+                 trend=5.0, window=10, boost=4, min_per_revolution=1):
+        """
+        Args:
+            mode (str): One of MODES.
+            every_nth (int): Sampling period in frames for the every_nth and adaptive modes.
+            min_interval (float): Minimum seconds between sampled frames for the rate mode.
+            threshold (float): Blurriness score the adaptive mode watches.
+            margin (float): Distance to `threshold` below which the adaptive mode samples densely.
+            trend (float): Score change per sampled frame above which the adaptive mode samples densely.
+            window (int): Number of recent scores the adaptive mode looks at.
+            boost (int): Factor by which the adaptive mode shortens the sampling period.
+            min_per_revolution (int): Frames always scored at the start of each revolution.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown sampling mode {mode!r}, expected one of {self.MODES}")
+        self.mode = mode
+        self.every_nth = max(1, int(every_nth))
+        self.min_interval = min_interval
+        self.threshold = threshold
+        self.margin = margin
+        self.trend = trend
+        self.boost = max(1, int(boost))
+        self.min_per_revolution = min_per_revolution
+        self.scale = 1.0
+
+        self.recent_scores = deque(maxlen=max(2, window))
+        self.revolution = None
+        self._sampled_in_revolution = 0
+        self._since_last_sample = 0
+        self._last_sample_time = None
+        self.frames_seen = 0
+        self.frames_sampled = 0
+
+    def should_sample(self, timestamp=None, revolution=None):
+        """
+        Decide whether the next frame is scored.
+
+        Args:
+            timestamp (float): Capture time of the frame in seconds, used by the rate mode.
+            revolution: Revolution the frame belongs to, None if unknown.
+
+        Returns:
+            bool: True if the frame should be scored.
+        """
+        self.frames_seen += 1
+        self._since_last_sample += 1
+        if revolution is not None and revolution != self.revolution:
+            self.revolution = revolution
+            self._sampled_in_revolution = 0
+
+        if revolution is not None and self._sampled_in_revolution < self.min_per_revolution:
+            sample = True
+        elif self.mode == "all":
+            sample = self._since_last_sample >= self.scale
+        elif self.mode == "rate":
+            sample = (timestamp is None or self._last_sample_time is None
+                      or timestamp - self._last_sample_time >= self.min_interval * self.scale)
+        else:
+            sample = self._since_last_sample >= self.current_period()
+
+        if sample:
+            self.frames_sampled += 1
+            self._sampled_in_revolution += 1
+            self._since_last_sample = 0
+            if timestamp is not None:
+                self._last_sample_time = timestamp
+        return sample
+
+    def record_score(self, score):
+        """Feed back the score of a sampled frame."""
+        self.recent_scores.append(score)
+
+    def current_period(self):
+        """Return the current sampling period in frames."""
+        if self.mode == "adaptive" and self.is_interesting():
+            return max(1, int(self.every_nth * self.scale) // self.boost)
+        return max(1, int(self.every_nth * self.scale))
+
+    def is_interesting(self):
+        """True while the recent scores are close to the threshold or trending."""
+        if not self.recent_scores:
+            return True
+        scores = list(self.recent_scores)
+        mean_score = sum(scores) / len(scores)
+        if abs(mean_score - self.threshold) < self.margin:
+            return True
+        if len(scores) < 2:
+            return False
+        # mean change per sample between the older and newer half of the window
+        half = len(scores) // 2
+        older = sum(scores[:half]) / half
+        newer = sum(scores[half:]) / (len(scores) - half)
+        return abs(newer - older) / max(1, len(scores) - half) > self.trend
+
+    def metrics(self):
+        """Return sampling counters."""
+        return {
+            "mode": self.mode,
+            "frames_seen": self.frames_seen,
+            "frames_sampled": self.frames_sampled,
+            "period": self.current_period(),
+            "scale": self.scale,
+        }
@@ -0,0 +1,186 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class DoffScheduler:
+    """
+    Bounded worker pool for doff-list batch jobs.
+
+    Jobs are keyed by roll: a batch submitted while another batch of the same roll is
+    still waiting is merged into it instead of queued separately. Batches of the current
+    roll are picked before batches of older rolls, and the number of threads never
+    exceeds `max_workers` however fast revolutions come in.
+    """
+
+    PRIORITY_CURRENT_ROLL = 0
+    PRIORITY_PREVIOUS_ROLL = 1
+
+    def __init__(self, handler, max_workers=1, name="doff-scheduler"):
+        """
+        Args:
+            handler (callable): Called as handler(doff_list, roll_id, *args) for every job.
+            max_workers (int): Number of worker threads.
+            name (str): Prefix of the worker thread names.
+        """
+        self.handler = handler
+        self.max_workers = max_workers
+        self.name = name
+
+        self._condition = threading.Condition()
+        self._heap = []          # (priority, sequence, roll_id)
+        self._pending = {}       # roll_id -> job waiting to run
+        self._sequence = itertools.count()
+        self._stopping = False
+        self._workers = []
+
+        self._submitted = 0
+        self._coalesced = 0
+        self._completed = 0
+        self._failed = 0
+        self._running = 0
+        self._max_queue_depth = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+        self._max_latency = 0.0
+
+    def start(self):
+        """Start the worker threads."""
+        with self._condition:
+            if self._workers:
+                return
+            self._stopping = False
+            for i in range(self.max_workers):
+                worker = threading.Thread(target=self._work, name=f"{self.name}-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, doff_list, roll_id, *args, current=False):
+        """
+        Queue a doff batch, merging it into a waiting batch of the same roll if there is one.
+
+        Args:
+            doff_list (list): Doffs (revolutions) to process.
+            roll_id: Roll the doffs belong to.
+            *args: Extra arguments passed on to the handler.
+            current (bool): True if the batch belongs to the roll currently on the machine.
+
+        Returns:
+            bool: True if the batch was merged into a waiting one.
+        """
+        priority = self.PRIORITY_CURRENT_ROLL if current else self.PRIORITY_PREVIOUS_ROLL
+        with self._condition:
+            if self._stopping:
+                raise RuntimeError("Scheduler is stopped.")
+            self._submitted += 1
+            job = self._pending.get(roll_id)
+            if job is not None:
+                job["doff_list"].extend(doff for doff in doff_list if doff not in job["doff_list"])
+                job["args"] = args
+                self._coalesced += 1
+                if priority < job["priority"]:
+                    # re-queue at the higher priority, the old heap entry becomes stale
+                    job["priority"] = priority
+                    job["sequence"] = next(self._sequence)
+                    heapq.heappush(self._heap, (priority, job["sequence"], roll_id))
+                return True
+
+            job = {
+                "doff_list": list(doff_list),
+                "args": args,
+                "priority": priority,
+                "sequence": next(self._sequence),
+                "submitted_at": time.time(),
+            }
+            self._pending[roll_id] = job
+            heapq.heappush(self._heap, (priority, job["sequence"], roll_id))
+            self._max_queue_depth = max(self._max_queue_depth, len(self._pending))
+            self._condition.notify()
+            return False
+
+    def shutdown(self, wait=True, cancel_pending=False):
+        """
+        Stop the workers once the queue is empty.
+
+        Args:
+            wait (bool): Block until the worker threads have exited.
+            cancel_pending (bool): Drop the batches that have not started yet.
+        """
+        with self._condition:
+            self._stopping = True
+            if cancel_pending:
+                self._heap = []
+                self._pending = {}
+            self._condition.notify_all()
+            workers = list(self._workers)
+        if wait:
+            for worker in workers:
+                worker.join()
+        with self._condition:
+            self._workers = []
+
+    def metrics(self):
+        """
+        Return queue depth and job latency metrics.
+
+        Returns:
+            dict: Counters and latencies in seconds. Latency runs from submission to completion.
+        """
+        with self._condition:
+            finished = self._completed + self._failed
+            return {
+                "queue_depth": len(self._pending),
+                "max_queue_depth": self._max_queue_depth,
+                "running": self._running,
+                "submitted": self._submitted,
+                "coalesced": self._coalesced,
+                "completed": self._completed,
+                "failed": self._failed,
+                "avg_wait": self._total_wait / finished if finished else 0.0,
+                "avg_run": self._total_run / finished if finished else 0.0,
+                "avg_latency": (self._total_wait + self._total_run) / finished if finished else 0.0,
+                "max_latency": self._max_latency,
+            }
+
+    def _next_job(self):
+        # Called with the condition held; returns None once stopping with nothing left to run
+        while True:
+            while self._heap:
+                priority, sequence, roll_id = heapq.heappop(self._heap)
+                job = self._pending.get(roll_id)
+                if job is None or job["sequence"] != sequence:
+                    continue  # stale entry of a re-prioritised job
+                del self._pending[roll_id]
+                return roll_id, job
+            if self._stopping:
+                return None
+            self._condition.wait()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                next_job = self._next_job()
+                if next_job is None:
+                    return
+                self._running += 1
+            roll_id, job = next_job
+
+            started_at = time.time()
+            failed = False
+            try:
+                self.handler(job["doff_list"], roll_id, *job["args"])
+            except Exception as e:
+                failed = True
+                print(f"Doff job for roll {roll_id} failed: {e}")
+            finished_at = time.time()
+
+            with self._condition:
+                self._running -= 1
+                if failed:
+                    self._failed += 1
+                else:
+                    self._completed += 1
+                self._total_wait += started_at - job["submitted_at"]
+                self._total_run += finished_at - started_at
+                self._max_latency = max(self._max_latency, finished_at - job["submitted_at"])
@@ -0,0 +1,140 @@
+import os
+import time
+import numpy as np
+
+# cv2 and BlurDetector (which pulls in skimage) are imported on first use, so processes that
+# only schedule work, like the service's event loop, start without them
+
+# Detector parameters used by the live service
+DEFAULT_DETECTOR_KWARGS = {
+    "downsampling_factor": 4,
+    "num_scales": 3,
+    "scale_start": 2,
+    "entropy_filt_kernel_sze": 7,
+    "sigma_s_RF_filter": 15,
+    "sigma_r_RF_filter": 0.25,
+    "num_iterations_RF_filter": 3,
+    "show_progress": False,
+}
+
+def detector_label(detector_kwargs):
+    """
+    Short name of the parameters that change the scale of scores and maps, e.g. "ds4-ns3".
+
+    Scores and maps under different labels are not comparable.
+    """
+    detector_kwargs = detector_kwargs or DEFAULT_DETECTOR_KWARGS
+    return f"ds{detector_kwargs['downsampling_factor']}-ns{detector_kwargs['num_scales']}"
+
+
+# One detector per parameter set and per process, so executor workers reuse their setup between frames
+_detectors = {}
+
+
+def get_detector(detector_kwargs):
+    """
+    Return the cached BlurDetector of this process for the given parameters.
+
+    Args:
+        detector_kwargs (dict): Keyword arguments for BlurDetector.
+
+    Returns:
+        BlurDetector: The detector instance.
+    """
+    key = tuple(sorted(detector_kwargs.items()))
+    detector = _detectors.get(key)
+    if detector is None:
+        from BlurDetector import BlurDetector
+        detector = BlurDetector(**detector_kwargs)
+        _detectors[key] = detector
+    return detector
+
+
+def warm_up(detector_kwargs=None, shape=None):
+    """
+    Create and warm up the detector of this process so the first frame is not slowed by setup.
+
+    Used as executor initializer.
+
+    Args:
+        detector_kwargs (dict): Keyword arguments for BlurDetector.
+        shape (tuple): Expected frame size (rows, cols), to also preallocate the work buffers.
+    """
+    import cv2  # loaded here so the first score_image call does not pay for it
+    get_detector(detector_kwargs or DEFAULT_DETECTOR_KWARGS).warmUp(shape)
+
+
+def read_jpeg_shape(img_path):
+    """
+    Read the size of a JPEG image from its header, without decoding it or loading cv2.
+
+    Args:
+        img_path (str): Path of the image file.
+
+    Returns:
+        tuple: (rows, cols), or None if the file is not a readable JPEG.
+    """
+    with open(img_path, "rb") as img_file:
+        if img_file.read(2) != b"\xff\xd8":
+            return None
+        while True:
+            marker = img_file.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            if marker[1] == 0xFF:
+                # fill byte before a marker
+                img_file.seek(-1, os.SEEK_CUR)
+                continue
+            if marker[1] == 0x01 or 0xD0 <= marker[1] <= 0xD8:
+                # markers without a payload
+                continue
+            length = int.from_bytes(img_file.read(2), "big")
+            # start-of-frame markers (not DHT, JPG or DAC, which share the 0xC? range) hold the size
+            if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                header = img_file.read(5)
+                if len(header) < 5:
+                    return None
+                return int.from_bytes(header[1:3], "big"), int.from_bytes(header[3:5], "big")
+            if marker[1] == 0xDA or length < 2:
+                # entropy-coded data starts without a frame header
+                return None
+            img_file.seek(length - 2, os.SEEK_CUR)
+
+
+def score_image(img_path, detector_kwargs=None, return_map=False):
+    """
+    Read an image from disk and compute its blurriness score.
+
+    Runs in an executor worker, so it only takes and returns picklable values.
+
+    Args:
+        img_path (str): Path of the image file.
+        detector_kwargs (dict): Keyword arguments for BlurDetector.
+        return_map (bool): Also return the downsampled blur map (float32) as "entropy_map".
+
+    Returns:
+        dict: path, score, elapsed wall seconds and cpu seconds of this process, or None if the image could not be read.
+    """
+    import cv2
+    start_time = time.time()
+    start_cpu = time.process_time()
+    img = cv2.imread(img_path, 0)
+    if img is None:
+        return None
+    detector = get_detector(detector_kwargs or DEFAULT_DETECTOR_KWARGS)
+    if not return_map:
+        score = detector.detectBlurScore(img)
+        return {
+            "path": img_path,
+            "score": float(score),
+            "elapsed": time.time() - start_time,
+            "cpu": time.process_time() - start_cpu,
+        }
+    score, entropy_map = detector.detectBlurScore(img, return_entropy_map=True)
+    return {
+        "path": img_path,
+        "score": float(score),
+        "entropy_map": entropy_map.astype(np.float32),
+        "elapsed": time.time() - start_time,
+        "cpu": time.process_time() - start_cpu,
+    }
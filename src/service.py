@@ -0,0 +1,516 @@
+import asyncio
+import collections
+import concurrent.futures
+import os
+import signal
+import time
+import numpy as np
+
+from src.calibration import CalibrationCache
+from src.sampling import FrameSampler
+from src.scoring import DEFAULT_DETECTOR_KWARGS, detector_label, score_image, warm_up
+
+
+def _init_worker(detector_kwargs, shape):
+    # forked workers inherit the service's signal handling: leave SIGINT (sent to the whole process
+    # group on Ctrl-C) to the service, let SIGTERM terminate the worker, and stop forwarding signals
+    # to the service's event loop through the inherited wakeup fd
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    warm_up(detector_kwargs, shape)
+
+
+class ConsoleSink:
+    """
+    Result sink printing every scored frame and folder verdict.
+    """
+
+    def on_frame(self, record):
+        print(f"Image: {os.path.basename(record['path'])}, Blurriness Score: {record['score']}, "
+              f"Blurry: {record['blurry']} (threshold {record['threshold']:.1f})")
+
+    def on_summary(self, summary):
+        print(summary["result"])
+
+
+class LogFileSink:
+    """
+    Result sink appending folder verdicts to a log file.
+    """
+
+    def __init__(self, log_file_path):
+        """
+        Args:
+            log_file_path (str): Path of the log file the verdicts are appended to.
+        """
+        self.log_file_path = log_file_path
+
+    def on_summary(self, summary):
+        with open(self.log_file_path, "a") as log_file:
+            log_file.write(summary["result"] + "\n")
+
+
+class ArchiveSink:
+    """
+    Result sink storing every scored frame's downsampled blur map and score in a BlurMapArchive.
+
+    Needs the service to run with return_maps=True.
+    """
+
+    def __init__(self, archive):
+        """
+        Args:
+            archive (BlurMapArchive): Archive the frames are appended to.
+        """
+        self.archive = archive
+
+    def on_frame(self, record):
+        if record.get("entropy_map") is None:
+            return
+        self.archive.append(record["roll_id"], record["camera"], record["entropy_map"], record["score"],
+                            timestamp=record["timestamp"], name=os.path.basename(record["path"]),
+                            detector_kwargs=record.get("detector_kwargs"))
+
+
+class BlurService:
+    """
+    Asyncio service core for blur detection.
+
+    DB polling, filesystem ingestion, scoring and result sinks run as cooperating tasks
+    of one event loop. Scoring is offloaded to a process pool: at most `max_workers`
+    frames are scored at a time and at most `queue_size` frames wait to be scored, so
+    the scanner is throttled instead of piling up work when the cameras run ahead.
+    New frames pass through a per-camera FrameSampler before they are queued, and
+    every scored frame is judged against the calibrated baseline of its camera on
+    the current roll.
+    An optional CpuBudgetController adjusts the number of active workers, the
+    sampling rate and the detector parameters to the measured cost of scoring.
+    """
+
+    MISSING_DIRECTORY_REPORT_INTERVAL = 60  # seconds between reports of the same missing image directory
+    POOL_FAILURE_LIMIT = 2  # pool breakdowns a frame may be in flight for before it counts as failed
+
+    def __init__(self, fetcher, detector_kwargs=None, sinks=None, max_workers=2, queue_size=64,
+                 poll_interval=5, scan_interval=10, drain_timeout=30, blur_threshold=175, sampling=None,
+                 calibration=None, calibration_save_interval=300, return_maps=False, warmup_shape=None,
+                 controller=None):
+        """
+        Args:
+            fetcher (FetchImage): Source of roll, camera and image directory details.
+            detector_kwargs (dict): Keyword arguments for BlurDetector.
+            sinks (list): Objects with optional on_frame(record) and on_summary(summary) methods.
+            max_workers (int): Number of frames scored concurrently.
+            queue_size (int): Maximum number of frames waiting to be scored.
+            poll_interval (float): Seconds between database polls.
+            scan_interval (float): Seconds between image directory scans.
+            drain_timeout (float): Seconds to wait for queued frames on shutdown.
+            blur_threshold (float): Blurriness above which a frame is blurry while its camera is uncalibrated.
+            sampling (dict): Keyword arguments for the FrameSampler of each camera.
+            calibration (CalibrationCache): Per-camera and per-roll baselines, an in-memory cache if None.
+            calibration_save_interval (float): Seconds between saves of the calibration cache.
+            return_maps (bool): Pass each frame's downsampled blur map to the sinks as "entropy_map".
+            warmup_shape (tuple): Expected frame size, lets the workers preallocate their buffers at startup.
+            controller (CpuBudgetController): Throttles scoring to a CPU budget; sinks with an
+                on_metrics(metrics) method receive its decisions every control interval.
+        """
+        self.fetcher = fetcher
+        self.detector_kwargs = dict(detector_kwargs or DEFAULT_DETECTOR_KWARGS)
+        self.sinks = list(sinks or [])
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self.scan_interval = scan_interval
+        self.drain_timeout = drain_timeout
+        self.blur_threshold = blur_threshold
+        self.sampling = dict(sampling or {})
+        self.sampling.setdefault("threshold", blur_threshold)
+        self.calibration = calibration or CalibrationCache(fallback_threshold=blur_threshold)
+        self.calibration_save_interval = calibration_save_interval
+        self.return_maps = return_maps
+        self.warmup_shape = warmup_shape
+        self.controller = controller
+        self._last_calibration_save = time.time()
+
+        self.roll_id = None
+        self.revolution = None
+        self.revolutions = collections.deque(maxlen=1024)  # (time first seen, revolution), oldest first
+        self.cameras = []
+        self.samplers = {}   # camera -> FrameSampler
+        self.stats = {"frames_skipped": 0, "frames_queued": 0, "frames_scored": 0, "frames_failed": 0, "pool_restarts": 0}
+
+        self._seen = {}      # folder -> names of the images already sampled or skipped
+        self._missing = {}   # folder -> time its absence was last reported
+        self._batches = {}   # batch id -> frames of one directory scan
+        self._next_batch = 0
+        self._loop = None
+        self._stop_event = None
+        self._queue = None
+        self._results = None
+        self._io_executor = None
+        self._cpu_executor = None
+
+    async def run(self):
+        """
+        Run the service until stop() is called or SIGINT/SIGTERM is received.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._results = asyncio.Queue()
+        # psycopg2 connections and the sinks are not meant for concurrent use, so all blocking I/O shares one thread
+        self._io_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._cpu_executor = self._create_cpu_executor()
+        # fork the workers before the signal handlers are installed, so they do not inherit them
+        await self._start_workers()
+        handled_signals = self._install_signal_handlers()
+
+        producers = [asyncio.create_task(self._poll_loop()), asyncio.create_task(self._scan_loop())]
+        if self.controller is not None:
+            producers.append(asyncio.create_task(self._control_loop()))
+        scorers = [asyncio.create_task(self._score_loop(index)) for index in range(self.max_workers)]
+        sink = asyncio.create_task(self._sink_loop())
+        print("Blur service started.")
+        try:
+            await self._stop_event.wait()
+        finally:
+            print("Stopping blur service...")
+            await self._cancel(producers)
+            await self._drain(self._queue, "scoring")
+            await self._cancel(scorers)
+            await self._drain(self._results, "result")
+            await self._cancel([sink])
+            await self._flush_batches()
+            self._save_calibration()
+            for sig in handled_signals:
+                self._loop.remove_signal_handler(sig)
+            self._cpu_executor.shutdown(wait=True, cancel_futures=True)
+            self._io_executor.shutdown(wait=True)
+            print(f"Blur service stopped: {self.stats}")
+
+    def _create_cpu_executor(self):
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.max_workers, initializer=_init_worker, initargs=(self.detector_kwargs, self.warmup_shape))
+
+    def _restart_cpu_executor(self, broken_executor):
+        # several scorers see the same breakdown, only the first one replaces the pool
+        if broken_executor is not self._cpu_executor:
+            return
+        broken_executor.shutdown(wait=False, cancel_futures=True)
+        self._cpu_executor = self._create_cpu_executor()
+        self.stats["pool_restarts"] += 1
+
+    async def _start_workers(self):
+        # the pool starts its processes on demand; one task per worker starts (and warms up) all of them now
+        start_time = time.time()
+        await asyncio.gather(*[self._loop.run_in_executor(self._cpu_executor, os.getpid) for _ in range(self.max_workers)])
+        print(f"Started {self.max_workers} scoring workers in {time.time() - start_time:.2f} seconds")
+
+    def metrics(self):
+        """
+        Return the service counters, queue depths and the current throttling decisions.
+        """
+        metrics = dict(self.stats)
+        metrics["queue_depth"] = self._queue.qsize() if self._queue is not None else 0
+        metrics["samplers"] = {cam_name: sampler.metrics() for cam_name, sampler in self.samplers.items()}
+        if self.controller is not None:
+            metrics["throttle"] = self.controller.metrics()
+        return metrics
+
+    def stop(self):
+        """
+        Request a graceful shutdown. Safe to call from any thread.
+        """
+        if self._loop is not None and self._stop_event is not None:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+
+    def _install_signal_handlers(self):
+        handled_signals = []
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self._loop.add_signal_handler(sig, self._stop_event.set)
+                handled_signals.append(sig)
+            except (NotImplementedError, RuntimeError):
+                # Not supported on this platform or outside the main thread
+                pass
+        return handled_signals
+
+    async def _cancel(self, tasks):
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _drain(self, queue, name):
+        try:
+            await asyncio.wait_for(queue.join(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            print(f"Gave up waiting for {queue.qsize()} queued {name} items.")
+
+    def _save_calibration(self):
+        try:
+            self.calibration.save()
+        except OSError as e:
+            print(f"Failed to save calibration cache: {e}")
+        self._last_calibration_save = time.time()
+
+    async def _run_io(self, func, *args):
+        return await self._loop.run_in_executor(self._io_executor, func, *args)
+
+    async def _poll_loop(self):
+        """Keep the current roll and the list of active cameras up to date."""
+        while True:
+            try:
+                await self._run_io(self.fetcher.fetch_roll_details)
+                cameras = await self._run_io(self.fetcher.fetch_active_cameras)
+                if self.fetcher.roll_id != self.roll_id:
+                    print(f"Roll changed from {self.roll_id} to {self.fetcher.roll_id}")
+                    if self.roll_id is not None:
+                        self.calibration.clear(fabric=self.roll_id)
+                    self.roll_id = self.fetcher.roll_id
+                if self.fetcher.revolution != self.revolution:
+                    self.revolution = self.fetcher.revolution
+                    self.revolutions.append((time.time(), self.revolution))
+                self.cameras = cameras
+            except Exception as e:
+                print(f"Failed to poll roll and camera details: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _control_loop(self):
+        """Let the controller adjust the scoring load to the CPU budget."""
+        while True:
+            await asyncio.sleep(self.controller.interval)
+            action = self.controller.update()
+            if action is not None:
+                print(f"CPU budget: {action}")
+            await self._emit("on_metrics", self.metrics())
+
+    async def _scan_loop(self):
+        """Queue the images that appeared in the directories of the active cameras since the last scan."""
+        while True:
+            if self.roll_id is None or not self.cameras:
+                print("No valid roll or camera details found. Retrying...")
+            else:
+                folders = set()
+                for cam_name in list(self.cameras):
+                    # folders are named by roll_id, the same path FetchImage.fetch_images_from_directory builds
+                    folder_path = self.fetcher.image_directory(self.roll_id, cam_name)
+                    folders.add(folder_path)
+                    try:
+                        images = await self._run_io(self._list_images, folder_path)
+                    except Exception as e:
+                        print(f"Failed to list {folder_path}: {e}")
+                        continue
+                    if images is None:
+                        self._report_missing(folder_path)
+                        continue
+                    self._missing.pop(folder_path, None)
+                    await self._enqueue(folder_path, cam_name, images)
+                # forget the folders of past hours and rolls
+                for folder_path in list(self._seen):
+                    if folder_path not in folders:
+                        del self._seen[folder_path]
+                for folder_path in list(self._missing):
+                    if folder_path not in folders:
+                        del self._missing[folder_path]
+            await asyncio.sleep(self.scan_interval)
+
+    def _list_images(self, folder_path):
+        # (modification time, filename) of the images in capture order, None if the directory does not exist
+        if not os.path.isdir(folder_path):
+            return None
+        with os.scandir(folder_path) as entries:
+            images = [(entry.stat().st_mtime, entry.name) for entry in entries if entry.name.endswith(".jpg")]
+        return sorted(images)
+
+    def _report_missing(self, folder_path):
+        # a camera that has not written this hour's folder yet would otherwise be reported every scan
+        now = time.time()
+        if now - self._missing.get(folder_path, 0) >= self.MISSING_DIRECTORY_REPORT_INTERVAL:
+            print(f"No directory found at {folder_path}")
+            self._missing[folder_path] = now
+
+    def _revolution_at(self, timestamp):
+        # revolution that was current when the frame was written; changes are only seen once per
+        # poll, so a frame within poll_interval after a change may still count for the previous one
+        for seen_at, revolution in reversed(self.revolutions):
+            if seen_at <= timestamp:
+                return revolution
+        return None
+
+    def _sampler(self, cam_name):
+        sampler = self.samplers.get(cam_name)
+        if sampler is None:
+            sampler = FrameSampler(**self.sampling)
+            self.samplers[cam_name] = sampler
+        return sampler
+
+    async def _enqueue(self, folder_path, cam_name, images):
+        seen = self._seen.setdefault(folder_path, set())
+        sampler = self._sampler(cam_name)
+        if self.controller is not None:
+            sampler.scale = self.controller.sampling_scale
+        new_filenames = []
+        for mtime, filename in images:
+            if filename in seen:
+                continue
+            seen.add(filename)
+            if sampler.should_sample(mtime, self._revolution_at(mtime)):
+                new_filenames.append((mtime, filename))
+            else:
+                self.stats["frames_skipped"] += 1
+        if not new_filenames:
+            return
+        batch_id = self._next_batch
+        self._next_batch += 1
+        batch = self._batches[batch_id] = {
+            "folder": folder_path,
+            "camera": cam_name,
+            "roll_id": self.roll_id,
+            "pending": 0,      # frames queued and not handled yet
+            "queuing": True,   # more frames of this scan may still be queued
+            "scores": [],
+            "verdicts": [],
+            "start_time": time.time(),
+        }
+        try:
+            for mtime, filename in new_filenames:
+                job = {
+                    "path": os.path.join(folder_path, filename),
+                    "timestamp": mtime,
+                    "camera": cam_name,
+                    "roll_id": self.roll_id,
+                    "batch": batch_id,
+                }
+                # blocks while the scorers are behind; cancelled here on shutdown
+                await self._queue.put(job)
+                batch["pending"] += 1
+                self.stats["frames_queued"] += 1
+        finally:
+            batch["queuing"] = False
+        if batch["pending"] == 0:
+            # every frame was already handled while the rest were being queued
+            await self._finish_batch(batch_id)
+
+    def _worker_limit(self):
+        return self.controller.worker_limit if self.controller is not None else self.max_workers
+
+    async def _score_loop(self, index):
+        while True:
+            # scorers above the controller's worker limit stay idle
+            while index >= self._worker_limit():
+                await asyncio.sleep(1)
+            job = await self._queue.get()
+            try:
+                if self.controller is not None:
+                    detector_kwargs = self.controller.detector_kwargs
+                else:
+                    detector_kwargs = self.detector_kwargs
+                job["detector_kwargs"] = detector_kwargs
+                result = await self._score(job)
+                self._results.put_nowait((job, result))
+            finally:
+                self._queue.task_done()
+
+    async def _score(self, job):
+        # a worker killed mid-frame (e.g. by the OOM killer) breaks the whole pool: replace the
+        # pool and score the frame again, unless the frame keeps breaking it
+        while True:
+            executor = self._cpu_executor
+            try:
+                return await self._loop.run_in_executor(
+                    executor, score_image, job["path"], job["detector_kwargs"], self.return_maps)
+            except concurrent.futures.BrokenExecutor as e:
+                if executor is self._cpu_executor:
+                    print(f"Scoring workers died ({e}), restarting them.")
+                    self._restart_cpu_executor(executor)
+                job["pool_failures"] = job.get("pool_failures", 0) + 1
+                if job["pool_failures"] >= self.POOL_FAILURE_LIMIT:
+                    print(f"Failed to score {job['path']}: the scoring workers died {job['pool_failures']} times on it")
+                    return None
+            except Exception as e:
+                print(f"Failed to score {job['path']}: {e}")
+                return None
+
+    async def _sink_loop(self):
+        while True:
+            job, result = await self._results.get()
+            try:
+                await self._handle_result(job, result)
+            except Exception as e:
+                print(f"Result sink failed for {job['path']}: {e}")
+            finally:
+                self._results.task_done()
+
+    async def _handle_result(self, job, result):
+        batch = self._batches[job["batch"]]
+        batch["pending"] -= 1
+        if result is None:
+            self.stats["frames_failed"] += 1
+        else:
+            self.stats["frames_scored"] += 1
+            if self.controller is not None:
+                self.controller.record(result["cpu"], result["elapsed"])
+            # scores of different detector parameters are not comparable, each parameter set has its own baseline
+            calibration_key = job["camera"]
+            if detector_label(job["detector_kwargs"]) != detector_label(self.detector_kwargs):
+                calibration_key = f"{job['camera']}@{detector_label(job['detector_kwargs'])}"
+            # the database has no fabric column; a roll is knitted from one fabric, so it stands in for it
+            verdict = self.calibration.observe(calibration_key, result["score"], fabric=job["roll_id"])
+            batch["scores"].append(result["score"])
+            batch["verdicts"].append(verdict["blurry"])
+            sampler = self._sampler(job["camera"])
+            sampler.threshold = verdict["threshold"]
+            if np.isfinite(result["score"]):
+                sampler.record_score(result["score"])
+            record = dict(result, camera=job["camera"], roll_id=job["roll_id"], timestamp=job["timestamp"],
+                          detector_kwargs=job["detector_kwargs"], **verdict)
+            await self._emit("on_frame", record)
+            if time.time() - self._last_calibration_save > self.calibration_save_interval:
+                await self._run_io(self._save_calibration)
+
+        if batch["pending"] == 0 and not batch["queuing"]:
+            await self._finish_batch(job["batch"])
+
+    async def _finish_batch(self, batch_id):
+        batch = self._batches.pop(batch_id)
+        if batch["scores"]:
+            await self._emit("on_summary", self._summarize(batch))
+
+    async def _flush_batches(self):
+        # on shutdown: the verdicts of scans cut short, from the frames scored so far
+        for batch_id, batch in list(self._batches.items()):
+            try:
+                await self._finish_batch(batch_id)
+            except Exception as e:
+                print(f"Result sink failed for {batch['folder']}: {e}")
+
+    def _summarize(self, batch):
+        # majority vote of the per-frame verdicts; featureless frames (NaN scores) count as blurry
+        # votes but are left out of the average
+        finite_scores = [score for score in batch["scores"] if np.isfinite(score)]
+        avg_blurriness = float(np.mean(finite_scores)) if finite_scores else None
+        score_text = f"a blurriness score of {avg_blurriness}" if finite_scores else "no finite blurriness score (featureless frames)"
+        blurry_fraction = float(np.mean(batch["verdicts"]))
+        blurry = blurry_fraction > 0.5
+        if blurry:
+            result = f"The folder {batch['folder']} contains mostly blurry images ({blurry_fraction:.0%} of scored frames) with {score_text}."
+        else:
+            result = f"The folder {batch['folder']} does not contain mostly blurry images ({blurry_fraction:.0%} of scored frames), with {score_text}."
+        return {
+            "folder": batch["folder"],
+            "camera": batch["camera"],
+            "roll_id": batch["roll_id"],
+            "num_frames": len(batch["scores"]),
+            "num_featureless": len(batch["scores"]) - len(finite_scores),
+            "avg_blurriness": avg_blurriness,
+            "blurry_fraction": blurry_fraction,
+            "blurry": blurry,
+            "elapsed": time.time() - batch["start_time"],
+            "result": result,
+        }
+
+    async def _emit(self, method_name, payload):
+        for sink in self.sinks:
+            method = getattr(sink, method_name, None)
+            if method is not None:
+                await self._run_io(method, payload)
@@ -0,0 +1,180 @@
+import os
+import time
+from collections import deque
+import numpy as np
+
+
+class CpuBudgetController:
+    """
+    Keep blur detection within a share of the machine's CPU and a per-frame latency target.
+
+    Scoring workers report the CPU seconds and wall time each frame took. Every
+    `interval` seconds update() compares the CPU used over the last `window` seconds
+    with `cpu_share` of all cores and the frame latency with `latency_target`, then
+    moves one knob one step:
+
+        latency too high -> cheaper detector parameters
+        CPU over budget  -> sample fewer frames, then fewer workers, then cheaper parameters
+        well under both  -> undo the last kind of step, quality first
+
+    Only one step is taken per update, and none until `min_frames` frames have been
+    measured since the previous step, so the effect of each step can be seen.
+    """
+
+    def __init__(self, detector_kwargs, max_workers, cpu_share=0.25, latency_target=2.0, window=60, interval=10,
+                 relax=0.6, min_frames=5, max_sampling_scale=16, max_downsampling_factor=8, min_num_scales=2,
+                 num_cpus=None):
+        """
+        Args:
+            detector_kwargs (dict): Detector parameters used while within budget.
+            max_workers (int): Upper bound on concurrently scoring workers.
+            cpu_share (float): Fraction of all CPU cores blur detection may use.
+            latency_target (float): Target seconds of wall time per frame.
+            window (float): Seconds of history the decisions are based on.
+            interval (float): Seconds between decisions.
+            relax (float): Fraction of the budget and latency target below which load is added back.
+            min_frames (int): Frames needed in the window before a decision is made.
+            max_sampling_scale (float): Largest factor by which sampling periods are stretched.
+            max_downsampling_factor (int): Coarsest downsampling_factor to fall back to.
+            min_num_scales (int): Fewest DCT scales to fall back to.
+            num_cpus (int): CPU cores of the machine, os.cpu_count() if None.
+        """
+        self.base_detector_kwargs = dict(detector_kwargs)
+        self.max_workers = max_workers
+        self.cpu_share = cpu_share
+        self.latency_target = latency_target
+        self.window = window
+        self.interval = interval
+        self.relax = relax
+        self.min_frames = min_frames
+        self.max_sampling_scale = max_sampling_scale
+        self.num_cpus = num_cpus or os.cpu_count() or 1
+
+        self.detector_levels = self._detector_levels(max_downsampling_factor, min_num_scales)
+        self.detector_level = 0
+        self.worker_limit = max_workers
+        self.sampling_scale = 1.0
+        self.last_action = None
+
+        self._frames = deque()  # (finished_at, cpu seconds, wall seconds)
+        self._started_at = time.time()
+
+    def _detector_levels(self, max_downsampling_factor, min_num_scales):
+        # cheaper and cheaper parameter sets: coarser downsampling first, then fewer scales
+        levels = [dict(self.base_detector_kwargs)]
+        kwargs = dict(self.base_detector_kwargs)
+        while kwargs["downsampling_factor"] < max_downsampling_factor:
+            kwargs = dict(kwargs, downsampling_factor=min(kwargs["downsampling_factor"] + 2, max_downsampling_factor))
+            levels.append(kwargs)
+        while kwargs["num_scales"] > min_num_scales:
+            kwargs = dict(kwargs, num_scales=kwargs["num_scales"] - 1)
+            levels.append(kwargs)
+        return levels
+
+    @property
+    def detector_kwargs(self):
+        """Detector parameters for the next frames."""
+        return self.detector_levels[self.detector_level]
+
+    def record(self, cpu_seconds, wall_seconds, finished_at=None):
+        """Report the cost of one scored frame."""
+        self._frames.append((finished_at or time.time(), cpu_seconds, wall_seconds))
+
+    def _trim(self, now):
+        while self._frames and self._frames[0][0] < now - self.window:
+            self._frames.popleft()
+
+    def measure(self, now=None):
+        """
+        Return the CPU utilization (fraction of all cores) and mean/p95 frame latency over the window.
+        """
+        now = now or time.time()
+        self._trim(now)
+        span = min(self.window, now - self._started_at)
+        if not self._frames or span <= 0:
+            return 0.0, 0.0, 0.0
+        cpu = np.array([frame[1] for frame in self._frames])
+        wall = np.array([frame[2] for frame in self._frames])
+        return float(cpu.sum() / (span * self.num_cpus)), float(wall.mean()), float(np.percentile(wall, 95))
+
+    def update(self, now=None):
+        """
+        Take at most one throttling step.
+
+        Returns:
+            str: The step taken, None if nothing changed.
+        """
+        utilization, latency, _ = self.measure(now)
+        action = None
+        if len(self._frames) < self.min_frames:
+            pass
+        elif latency > self.latency_target:
+            action = self._cheaper_detector()
+        elif utilization > self.cpu_share:
+            action = self._sample_less() or self._fewer_workers() or self._cheaper_detector()
+        elif utilization < self.relax * self.cpu_share and latency < self.relax * self.latency_target:
+            action = self._better_detector() or self._more_workers() or self._sample_more()
+        if action is not None:
+            self.last_action = action
+            # the window now mixes frames from before and after the step, start measuring afresh
+            self._frames.clear()
+            self._started_at = now or time.time()
+        return action
+
+    def _cheaper_detector(self):
+        if self.detector_level + 1 < len(self.detector_levels):
+            self.detector_level += 1
+            return f"detector level {self.detector_level}: {self._describe_detector()}"
+        return None
+
+    def _better_detector(self):
+        if self.detector_level > 0:
+            self.detector_level -= 1
+            return f"detector level {self.detector_level}: {self._describe_detector()}"
+        return None
+
+    def _describe_detector(self):
+        kwargs = self.detector_kwargs
+        return f"downsampling_factor={kwargs['downsampling_factor']}, num_scales={kwargs['num_scales']}"
+
+    def _sample_less(self):
+        if self.sampling_scale < self.max_sampling_scale:
+            self.sampling_scale = min(self.sampling_scale * 2, self.max_sampling_scale)
+            return f"sampling scale {self.sampling_scale:g}"
+        return None
+
+    def _sample_more(self):
+        if self.sampling_scale > 1:
+            self.sampling_scale = max(self.sampling_scale / 2, 1.0)
+            return f"sampling scale {self.sampling_scale:g}"
+        return None
+
+    def _fewer_workers(self):
+        if self.worker_limit > 1:
+            self.worker_limit -= 1
+            return f"worker limit {self.worker_limit}"
+        return None
+
+    def _more_workers(self):
+        if self.worker_limit < self.max_workers:
+            self.worker_limit += 1
+            return f"worker limit {self.worker_limit}"
+        return None
+
+    def metrics(self, now=None):
+        """Return the current measurements and decisions."""
+        utilization, latency, latency_p95 = self.measure(now)
+        return {
+            "cpu_utilization": utilization,
+            "cpu_share": self.cpu_share,
+            "latency_avg": latency,
+            "latency_p95": latency_p95,
+            "latency_target": self.latency_target,
+            "frames_in_window": len(self._frames),
+            "worker_limit": self.worker_limit,
+            "sampling_scale": self.sampling_scale,
+            "detector_level": self.detector_level,
+            "downsampling_factor": self.detector_kwargs["downsampling_factor"],
+            "num_scales": self.detector_kwargs["num_scales"],
+            "last_action": self.last_action,
+        }